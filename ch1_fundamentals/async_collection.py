@@ -0,0 +1,152 @@
+# asyncio adapter shared by the async stacks and queues
+import asyncio
+
+from linked_list import LinkedList
+
+class AsyncCollection(object):
+    '''Turns a synchronous collection into one coroutines can share. Items
+    live in the collection passed in, and put/take are its add/remove
+    methods, so the order (FIFO or LIFO) is the collection's own.
+    Waiting coroutines queue up in FIFO linked lists and are woken one at a
+    time, oldest first: an item is handed straight to the oldest waiting
+    taker, and a freed slot goes to the oldest waiting putter, so a newly
+    arrived coroutine can never jump ahead of one already waiting.
+    Subclasses set the exceptions raised when empty, full or closed'''
+
+    empty_error = IndexError
+    full_error = OverflowError
+    closed_error = RuntimeError
+
+    def __init__(self, items, put_item, take_item, capacity=None, return_item=None):
+        '''
+        Wraps an empty collection
+        INPUT: Collection holding the items, its add and remove methods,
+               largest number of items held (None for no limit), method
+               that puts an item back where take_item would remove it next
+               (default put_item, right for a stack but not for a queue)
+        '''
+        assert capacity is None or capacity > 0, 'Error - capacity must be positive, got {}'.format(capacity)
+        self.items = items
+        self.put_item = put_item
+        self.take_item = take_item
+        self.return_item = put_item if return_item is None else return_item
+        self.capacity = capacity
+        self.count = 0
+        self.closed = False
+        self.getters = LinkedList() # Futures of coroutines waiting to take
+        self.putters = LinkedList() # (future, item) of coroutines waiting to put
+
+    def __repr__(self):
+        return str(self.items)
+
+    def __iter__(self):
+        '''Iterates in the wrapped collection's order, without copying'''
+        return iter(self.items)
+
+    def __len__(self):
+        return self.count
+
+    def wake_getter(self, item):
+        '''Hands item to the oldest waiting taker, returns False if there is none'''
+        getters = self.getters
+        while getters.count:
+            future = getters.pop_front()
+            if not future.done(): # Skip takers cancelled while waiting
+                future.set_result(item)
+                return True
+        return False
+
+    def admit_putter(self):
+        '''Moves the item of the oldest waiting putter into the collection'''
+        putters = self.putters
+        while putters.count:
+            future, item = putters.pop_front()
+            if not future.done():
+                self.put_item(item)
+                self.count += 1
+                future.set_result(None)
+                return
+
+    def put_nowait(self, item):
+        '''Adds an item, raising full_error rather than waiting for space'''
+        if self.closed:
+            raise self.closed_error('put on closed collection')
+        if self.wake_getter(item):
+            return
+        if self.capacity is not None and self.count >= self.capacity:
+            raise self.full_error('put on full collection')
+        self.put_item(item)
+        self.count += 1
+
+    async def put(self, item):
+        '''Adds an item, waiting for space if the collection is full'''
+        try:
+            self.put_nowait(item)
+            return
+        except self.full_error:
+            pass
+        future = asyncio.get_running_loop().create_future()
+        self.putters.push_back((future, item))
+        await future
+
+    def take_nowait(self):
+        '''Removes an item, raising empty_error rather than waiting for one'''
+        if self.count:
+            item = self.take_item()
+            self.count -= 1
+            if self.putters.count:
+                self.admit_putter()
+            return item
+        if self.closed:
+            raise self.closed_error('take on closed and drained collection')
+        raise self.empty_error('take from empty collection')
+
+    async def take(self):
+        '''Removes an item, waiting for one if the collection is empty'''
+        try:
+            return self.take_nowait()
+        except self.empty_error:
+            pass
+        future = asyncio.get_running_loop().create_future()
+        self.getters.push_back(future)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Cancelled just after an item was handed over: pass it on so it
+            # isn't lost, or put it back to be taken next so the order holds
+            if future.done() and not future.cancelled() and future.exception() is None:
+                if not self.wake_getter(future.result()):
+                    self.return_item(future.result())
+                    self.count += 1
+            raise
+
+    def close(self):
+        '''Stops further puts. Waiting putters and takers get closed_error,
+        items already held can still be taken'''
+        self.closed = True
+        while self.getters.count:
+            future = self.getters.pop_front()
+            if not future.done():
+                future.set_exception(self.closed_error('collection closed'))
+        while self.putters.count:
+            future, _ = self.putters.pop_front()
+            if not future.done():
+                future.set_exception(self.closed_error('collection closed'))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        '''Takes items until the collection is closed and drained'''
+        try:
+            return await self.take()
+        except self.closed_error:
+            raise StopAsyncIteration
+
+    def is_empty(self):
+        '''Is the collection empty?'''
+        return self.count == 0
+
+    def size(self):
+        '''How many items are in the collection'''
+        return self.count
@@ -1,13 +1,35 @@
 # Bag ADT implementation
+import random
+
+from math import sqrt
 
 class Bag(object):
     def __init__(self):
         ''' Initializes an empty bag '''
         self.items = list() # Assume duplicates are allowed
+        self.modifications = 0 # Bumped on every add so iterators can fail fast
+
+    def __iter__(self):
+        ''' Iterates over the items without copying. Raises RuntimeError
+        if the bag is added to during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('bag changed during iteration')
+        for item in self.items:
+            yield item
+            if self.modifications != modifications:
+                raise RuntimeError('bag changed during iteration')
+
+    def __len__(self):
+        return len(self.items)
     
     def add(self, item):
         ''' Adds an item to a bag'''
         self.items.append(item)
+        self.modifications += 1
         
     def is_empty(self):
         ''' Returns bool showing if bag is empty'''
@@ -18,24 +40,252 @@ class Bag(object):
         return len(self.items)
 
 
+class CountedBag(Bag):
+    '''Bag storing each distinct item once with how many times it was added,
+    so memory grows with the number of distinct items rather than with the
+    number of adds. Items must be hashable'''
+
+    def __init__(self):
+        ''' Initializes an empty bag '''
+        self.items = dict() # Item -> number of times added
+        self.total = 0
+        self.modifications = 0
+
+    def __iter__(self):
+        ''' Iterates over the items, repeating each one as many times as it
+        was added, without expanding them into a list. Raises RuntimeError if
+        the bag is added to during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('bag changed during iteration')
+        for item, count in self.items.items():
+            for _ in range(count):
+                yield item
+                if self.modifications != modifications:
+                    raise RuntimeError('bag changed during iteration')
+
+    def __len__(self):
+        return self.total
+
+    def add(self, item, count=1):
+        ''' Adds an item to a bag, count times'''
+        assert count >= 1, 'Error - count must be at least 1, got {}'.format(count)
+        self.items[item] = self.items.get(item, 0) + count
+        self.total += count
+        self.modifications += 1
+
+    def count(self, item):
+        ''' Returns how many times item was added'''
+        return self.items.get(item, 0)
+
+    def distinct(self):
+        ''' Returns number of distinct items in the bag'''
+        return len(self.items)
+
+    def size(self):
+        ''' Returns number of items in the bag, counting duplicates'''
+        return self.total
+
+
+class StatsBag(Bag):
+    '''Bag of numbers that keeps running statistics instead of the numbers,
+    so memory stays O(1) however many are added: count, mean and the sum of
+    squared differences from the mean (Welford's update, which avoids the
+    cancellation of sum(x**2) - n*mean**2), plus min and max.
+    With sample_size > 0 it also keeps a uniform random sample of that many
+    of the numbers (reservoir sampling) for approximate quantiles.
+    Bags built over separate parts of a stream, e.g. in separate processes,
+    can be merged into the bag of the whole stream'''
+
+    def __init__(self, sample_size=0, seed=None):
+        ''' Initializes an empty bag
+        INPUT: Number of values to keep in the sample (0 for none), random seed'''
+        self.total = 0
+        self.mean_value = 0.0
+        self.m2 = 0.0 # Sum of squared differences from the mean
+        self.minimum = None
+        self.maximum = None
+        self.sample_size = sample_size
+        self.sample = list()
+        self.rng = random.Random(seed)
+        self.modifications = 0
+
+    def __iter__(self):
+        ''' Iterates over the sample, as the other values aren't kept'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('bag changed during iteration')
+        for value in self.sample:
+            yield value
+            if self.modifications != modifications:
+                raise RuntimeError('bag changed during iteration')
+
+    def __len__(self):
+        return self.total
+
+    def add(self, value):
+        ''' Adds a number to the bag'''
+        self.total += 1
+        delta = value - self.mean_value
+        self.mean_value += delta / self.total
+        self.m2 += delta * (value - self.mean_value)
+        if self.total == 1:
+            self.minimum = self.maximum = value
+        elif value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+
+        # Algorithm R: the n-th value replaces a random sample slot with probability k/n
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        elif self.sample_size:
+            slot = int(self.rng.random() * self.total)
+            if slot < self.sample_size:
+                self.sample[slot] = value
+        self.modifications += 1
+
+    def merge(self, other):
+        ''' Adds in the values summarised by another StatsBag (Chan et al.'s
+        pairwise update for mean and variance). The merged sample takes each
+        slot from either sample in proportion to the values not yet drawn
+        from its bag, so it stays close to uniform over both streams
+        INPUT: StatsBag, left unchanged
+        RETURNS: This bag'''
+        if other.total == 0:
+            return self
+        total = self.total + other.total
+        delta = other.mean_value - self.mean_value
+        self.m2 += other.m2 + delta * delta * self.total * other.total / total
+        self.mean_value += delta * other.total / total
+        if self.total == 0:
+            self.minimum, self.maximum = other.minimum, other.maximum
+        else:
+            self.minimum = min(self.minimum, other.minimum)
+            self.maximum = max(self.maximum, other.maximum)
+
+        mine = list(self.sample)
+        theirs = list(other.sample)
+        self.rng.shuffle(mine)
+        self.rng.shuffle(theirs)
+        left_mine, left_theirs = self.total, other.total
+        self.sample = list()
+        while len(self.sample) < self.sample_size and (mine or theirs):
+            if not theirs or (mine and self.rng.random() * (left_mine + left_theirs) < left_mine):
+                self.sample.append(mine.pop())
+                left_mine -= 1
+            else:
+                self.sample.append(theirs.pop())
+                left_theirs -= 1
+
+        self.total = total
+        self.modifications += 1
+        return self
+
+    def mean(self):
+        ''' Returns the mean of the values, None if the bag is empty'''
+        return self.mean_value if self.total else None
+
+    def variance(self):
+        ''' Returns the sample variance of the values, None with fewer than 2'''
+        return self.m2 / (self.total - 1) if self.total > 1 else None
+
+    def stddev(self):
+        ''' Returns the sample standard deviation, None with fewer than 2 values'''
+        variance = self.variance()
+        return None if variance is None else sqrt(variance)
+
+    def quantile(self, q):
+        ''' Returns the approximate q-quantile (0 <= q <= 1) from the sample'''
+        assert 0 <= q <= 1, 'Error - quantile must be in [0, 1], got {}'.format(q)
+        assert self.sample, 'Error - no sample to estimate quantiles from'
+        ordered = sorted(self.sample)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def size(self):
+        ''' Returns number of values added to the bag'''
+        return self.total
+
+
 # Unit tests for the bag
 if __name__ == '__main__':
 
-    test_bag = Bag()
-    
-    assert test_bag.size() == 0
-    assert test_bag.is_empty() == True
-    
-    test_bag.add('a')
-    assert test_bag.size() == 1
-    assert test_bag.is_empty() == False
+    for test_bag in (Bag(), CountedBag()):
+        assert test_bag.size() == 0
+        assert test_bag.is_empty() == True
+        
+        test_bag.add('a')
+        assert test_bag.size() == 1
+        assert test_bag.is_empty() == False
+
+        test_bag.add('a') # Will only pass if duplicates are allowed
+        assert test_bag.size() == 2
+        assert test_bag.is_empty() == False
 
-    test_bag.add('a') # Will only pass if duplicates are allowed
-    assert test_bag.size() == 2
-    assert test_bag.is_empty() == False
+        test_bag.add(1)
+        assert test_bag.size() == 3
+        assert test_bag.is_empty() == False
 
-    test_bag.add(1)
-    assert test_bag.size() == 3
-    assert test_bag.is_empty() == False
+        assert sorted(test_bag, key=str) == [1, 'a', 'a']
+        assert len(test_bag) == 3
+        try:
+            for item in test_bag:
+                test_bag.add(item)
+            assert False, 'Adding during iteration did not fail'
+        except RuntimeError:
+            pass
+        items = iter(test_bag)
+        test_bag.add('b')
+        try:
+            list(items)
+            assert False, 'Adding after iter() did not fail'
+        except RuntimeError:
+            pass
+
+    test_bag = CountedBag()
+    for token in ('to', 'be', 'or', 'not', 'to', 'be'):
+        test_bag.add(token)
+    test_bag.add('be', 3)
+    assert test_bag.count('to') == 2 and test_bag.count('be') == 5 and test_bag.count('is') == 0
+    assert test_bag.distinct() == 4
+    assert test_bag.size() == 9 and len(test_bag) == 9
+    assert sorted(test_bag) == ['be'] * 5 + ['not', 'or', 'to', 'to']
+    try:
+        test_bag.add('or', 0)
+        assert False, 'add with a count of 0 did not fail'
+    except AssertionError as e:
+        assert str(e).startswith('Error - count'), str(e)
     
+    # Statistics match the exact ones, whether built in one pass or merged from parts
+    import pickle
+    import statistics
+
+    rng = random.Random(1)
+    values = [rng.gauss(1e9, 3.0) for _ in range(20000)] # Large mean, small spread
+    whole = StatsBag(sample_size=500, seed=2)
+    for value in values:
+        whole.add(value)
+    parts = [StatsBag(sample_size=500, seed=idx) for idx in range(4)]
+    for idx, value in enumerate(values):
+        parts[idx % 7 % 4].add(value)
+    merged = StatsBag(sample_size=500, seed=3)
+    for part in parts:
+        merged.merge(pickle.loads(pickle.dumps(part))) # As if returned from another process
+
+    for test_bag in (whole, merged):
+        assert test_bag.size() == len(values) and len(test_bag) == len(values)
+        assert abs(test_bag.mean() - statistics.mean(values)) < 1e-5 # ~1e-14 relative
+        assert abs(test_bag.stddev() - statistics.stdev(values)) < 1e-6
+        assert test_bag.minimum == min(values) and test_bag.maximum == max(values)
+        assert len(list(test_bag)) == 500
+        assert abs(test_bag.quantile(0.5) - statistics.median(values)) < 0.5
+
+    assert StatsBag().mean() is None and StatsBag().variance() is None
+
     print('All tests passed')
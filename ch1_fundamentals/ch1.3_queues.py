@@ -1,5 +1,13 @@
 # Stack of strings class
+import asyncio
 import sys
+import threading
+
+from time import monotonic
+from timeit import default_timer
+
+from async_collection import AsyncCollection
+from linked_list import LinkedList
 
 class QueueBase(object):
     '''Abstract Queue (FIFO) class'''
@@ -33,14 +41,34 @@ class QueueList(QueueBase):
         '''Creates and new Stack'''
         super(QueueList, self).__init__()
         self.items = list()
+        self.modifications = 0 # Bumped on every enqueue/dequeue so iterators can fail fast
+
+    def __iter__(self):
+        '''Iterates from the oldest item to the newest without copying. Raises
+        RuntimeError if the queue changes during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('queue changed during iteration')
+        for item in self.items:
+            yield item
+            if self.modifications != modifications:
+                raise RuntimeError('queue changed during iteration')
+
+    def __len__(self):
+        return len(self.items)
 
     def enqueue(self, item):
         '''Adds an item to the stack'''
         self.items.append(item)
+        self.modifications += 1
         
     def dequeue(self):
         '''Pops the most recently added item off stack'''
         item = self.items.pop(0)
+        self.modifications += 1
         return item
         
     def is_empty(self):
@@ -52,78 +80,317 @@ class QueueList(QueueBase):
         '''How many items are in the stack'''
         return len(self.items)
 
-class LinkedListNode(object):
-    '''Node inside a linked list'''
-    def __init__(self, item, next_node):
-        self.item = item
-        self.next_node = next_node
-            
+class QueueRingBuffer(QueueBase):
+    '''Implements a Queue (FIFO) using a circular buffer in a list.
+    head is the index of the oldest item, and the newest is count-1 slots
+    after it (wrapping round). Capacity doubles when full and halves when a
+    quarter full, so enqueue and dequeue are amortised O(1)'''
+
+    MIN_CAPACITY = 8
+
+    def __init__(self, capacity=MIN_CAPACITY):
+        '''Creates and new Queue'''
+        super(QueueRingBuffer, self).__init__()
+        self.items = [None] * max(capacity, self.MIN_CAPACITY)
+        self.head = 0
+        self.count = 0
+        self.modifications = 0 # Bumped on every enqueue/dequeue so iterators can fail fast
+
     def __repr__(self):
-        return 'Item: {}, ptr: {}'.format(self.item, self.next_node)
-    
-class LinkedList(object):
-    '''Linked List class'''
-    
-    def __init__(self, verbose=False):
-        '''Creates a new linked list with no entries initially'''
-        self.first = None
-        self.last = None
-        self.verbose = verbose
+        return str(self.to_list())
+
+    def __iter__(self):
+        '''Iterates from the oldest item to the newest without copying. Raises
+        RuntimeError if the queue changes during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('queue changed during iteration')
+        items = self.items
+        capacity = len(items)
+        idx = self.head
+        for _ in range(self.count):
+            yield items[idx]
+            if self.modifications != modifications:
+                raise RuntimeError('queue changed during iteration')
+            idx += 1
+            if idx == capacity:
+                idx = 0
+
+    def __len__(self):
+        return self.count
+
+    def to_list(self):
+        '''Items from front to back as a list'''
+        end = self.head + self.count
+        if end <= len(self.items):
+            return self.items[self.head:end]
+        return self.items[self.head:] + self.items[:end - len(self.items)]
+
+    def resize(self, capacity):
+        '''Moves the items to a new buffer, front of the queue at index 0'''
+        items = self.to_list()
+        self.items = items + [None] * (capacity - self.count)
+        self.head = 0
+
+    def enqueue(self, item):
+        '''Adds an item on the back of the queue'''
+        capacity = len(self.items)
+        if self.count == capacity:
+            self.resize(2 * capacity)
+            capacity *= 2
+        tail = self.head + self.count
+        if tail >= capacity:
+            tail -= capacity
+        self.items[tail] = item
+        self.count += 1
+        self.modifications += 1
+
+    def requeue_front(self, item):
+        '''Puts an item back on the front of the queue, to be dequeued next'''
+        capacity = len(self.items)
+        if self.count == capacity:
+            self.resize(2 * capacity)
+            capacity *= 2
+        self.head -= 1
+        if self.head < 0:
+            self.head += capacity
+        self.items[self.head] = item
+        self.count += 1
+        self.modifications += 1
+
+    def dequeue(self):
+        '''Removes the item on the front of the queue'''
+        if self.count == 0:
+            raise IndexError('dequeue from empty queue')
+        item = self.items[self.head]
+        self.items[self.head] = None # Don't keep a reference to the item
+        self.head += 1
+        if self.head == len(self.items):
+            self.head = 0
+        self.count -= 1
+        self.modifications += 1
+
+        capacity = len(self.items)
+        if capacity > self.MIN_CAPACITY and self.count <= capacity // 4:
+            self.resize(capacity // 2)
+        return item
+
+    def enqueue_many(self, items):
+        '''Adds all the items on the back of the queue, copying slices'''
+        items = list(items)
+        capacity = len(self.items)
+        if self.count + len(items) > capacity:
+            while self.count + len(items) > capacity:
+                capacity *= 2
+            self.resize(capacity)
+
+        tail = (self.head + self.count) % capacity
+        first = min(len(items), capacity - tail) # Up to the end of the buffer
+        self.items[tail:tail + first] = items[:first]
+        self.items[:len(items) - first] = items[first:]
+        self.count += len(items)
+        self.modifications += 1
+
+    def dequeue_many(self, n):
+        '''Removes n items from the front of the queue, returned as a list'''
+        if n < 0:
+            raise ValueError('dequeue_many of negative count {}'.format(n))
+        if n > self.count:
+            raise IndexError('dequeue_many of {} from queue of {}'.format(n, self.count))
+        capacity = len(self.items)
+        first = min(n, capacity - self.head) # Up to the end of the buffer
+        rest = n - first
+        items = self.items[self.head:self.head + first] + self.items[:rest]
+        self.items[self.head:self.head + first] = [None] * first
+        self.items[:rest] = [None] * rest
+        self.head = (self.head + n) % capacity
+        self.count -= n
+        self.modifications += 1
+
+        while capacity > self.MIN_CAPACITY and self.count <= capacity // 4:
+            capacity //= 2
+        if capacity != len(self.items):
+            self.resize(max(capacity, self.MIN_CAPACITY))
+        return items
+
+    def is_empty(self):
+        '''Is the queue empty?'''
+        return self.count == 0
+
+    def size(self):
+        '''How many items are in the queue'''
+        return self.count
+
+class QueueEmpty(IndexError):
+    '''Raised by a non-blocking or timed-out dequeue on an empty queue'''
+
+class QueueFull(Exception):
+    '''Raised by a non-blocking or timed-out enqueue on a full queue'''
+
+class QueueClosed(Exception):
+    '''Raised on enqueue to a closed queue, or dequeue from a closed and
+    drained one'''
+
+class BlockingQueue(QueueBase):
+    '''Bounded thread-safe Queue (FIFO) for producer/consumer pipelines,
+    holding its items in a QueueRingBuffer. Enqueue blocks while the queue
+    is full (backpressure) and dequeue blocks while it is empty, both with an
+    optional timeout. Once closed, enqueues fail but the items left can still
+    be dequeued, after which dequeues raise QueueClosed'''
+
+    def __init__(self, capacity=1024):
+        '''Creates an empty queue holding at most capacity items'''
+        super(BlockingQueue, self).__init__()
+        assert capacity > 0, 'Error - capacity must be positive, got {}'.format(capacity)
+        self.capacity = capacity
+        self.buffer = QueueRingBuffer()
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
 
     def __repr__(self):
-        '''Returns a list of all the items in the linked list'''
-        items = list()
-        node = self.first
-        while node.next_node is not None:
-            items.append(node.item)
-            node = node.next_node
-        return str(items)
-
-    def push_front(self, item):
-        raise NotImplementedError
+        with self.lock:
+            return str(self.buffer)
 
-    def pop_front(self):
-        if self.first is None:
-            return None
-        
-        if self.first == self.last:
-            single_node = self.first
-            self.first = None
-            self.last = None
-            return single_node
-        
-        old_first = self.first
-        self.first = self.first.next_node
-        if self.verbose: print('After dequeue: {}'.format(self))
-        return old_first.item
-
-    def push_back(self, item):
-        if self.last is None:
-            new_node = LinkedListNode(item, None)
-            self.first = new_node
-            self.last = new_node
+    def __iter__(self):
+        '''Iterates from the oldest item to the newest without copying or
+        locking, so it raises RuntimeError if another thread enqueues or
+        dequeues meanwhile. drain() gives a consistent snapshot'''
+        return iter(self.buffer)
+
+    def __len__(self):
+        return self.buffer.count
+
+    def wait(self, condition, ready, block, timeout, error):
+        '''
+        Waits on condition (lock held) until ready() is true or the queue is closed
+        INPUT: Condition, function checking for readiness, whether to block,
+               seconds to wait (None waits forever), exception class to raise
+               if the queue isn't ready in time
+        RETURNS: None
+        '''
+        if ready() or self.closed:
             return
-        
-        old_last = self.last
-        new_node = LinkedListNode(item, None) # At end by definition so next is None
-        old_last.next_node = new_node
-        self.last = new_node
-        if self.verbose: print('After enqueue: {}'.format(self))
+        if not block:
+            raise error()
+        if timeout is None:
+            while not ready() and not self.closed:
+                condition.wait()
+            return
+        deadline = monotonic() + timeout
+        while not ready() and not self.closed:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise error()
+            condition.wait(remaining)
 
-    def pop_back(self):
-        raise NotImplementedError
+    def enqueue(self, item, block=True, timeout=None):
+        '''Adds an item on the back of the queue, waiting for space if full'''
+        buffer = self.buffer
+        with self.lock:
+            self.wait(self.not_full, lambda: buffer.count < self.capacity, block, timeout, QueueFull)
+            if self.closed:
+                raise QueueClosed('enqueue on closed queue')
+            buffer.enqueue(item)
+            self.not_empty.notify()
+
+    def dequeue(self, block=True, timeout=None):
+        '''Removes the item on the front of the queue, waiting for one if empty'''
+        buffer = self.buffer
+        with self.lock:
+            self.wait(self.not_empty, lambda: buffer.count > 0, block, timeout, QueueEmpty)
+            if buffer.count == 0:
+                raise QueueClosed('dequeue on closed and drained queue')
+            item = buffer.dequeue()
+            self.not_full.notify()
+            return item
+
+    def enqueue_many(self, items, block=True, timeout=None):
+        '''
+        Adds all the items on the back of the queue, in as few lock
+        acquisitions as the free space allows. The timeout applies to each
+        wait for space, and on QueueFull the items before the failing one
+        have been enqueued
+        INPUT: Iterable of items, whether to block, seconds to wait
+        RETURNS: None
+        '''
+        items = list(items)
+        buffer = self.buffer
+        start = 0
+        while start < len(items):
+            with self.lock:
+                self.wait(self.not_full, lambda: buffer.count < self.capacity, block, timeout, QueueFull)
+                if self.closed:
+                    raise QueueClosed('enqueue on closed queue')
+                end = min(len(items), start + self.capacity - buffer.count)
+                buffer.enqueue_many(items[start:end])
+                self.not_empty.notify(end - start)
+            start = end
+
+    def dequeue_many(self, max_items, block=True, timeout=None):
+        '''
+        Removes up to max_items from the front of the queue under one lock
+        acquisition, waiting only until at least one item is available
+        INPUT: Largest batch to return, whether to block, seconds to wait
+        RETURNS: List of 1 to max_items items, oldest first
+        '''
+        buffer = self.buffer
+        with self.lock:
+            self.wait(self.not_empty, lambda: buffer.count > 0, block, timeout, QueueEmpty)
+            if buffer.count == 0:
+                raise QueueClosed('dequeue on closed and drained queue')
+            items = buffer.dequeue_many(min(max_items, buffer.count))
+            self.not_full.notify(len(items))
+            return items
+
+    def close(self):
+        '''Stops further enqueues and wakes every waiting thread'''
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def drain(self):
+        '''Removes and returns every item in the queue without blocking'''
+        with self.lock:
+            items = self.buffer.dequeue_many(self.buffer.count)
+            self.not_full.notify_all()
+            return items
+
+    def is_empty(self):
+        '''Is the queue empty?'''
+        return self.buffer.count == 0
 
     def size(self):
-        ''' Check how many items are in the linked list'''
-        if self.first is None:
-            return 0
-        node = self.first
-        node_count = 0
-        
-        while node.next_node is not None:
-            node_count += 1
-            node = node.next_node
-        return node_count
+        '''How many items are in the queue'''
+        return self.buffer.count
+
+class AsyncQueue(AsyncCollection, QueueBase):
+    '''Queue (FIFO) shared by asyncio coroutines, holding its items in a
+    QueueRingBuffer. enqueue waits while the queue is at capacity and
+    dequeue while it is empty, and waiters are woken oldest first.
+    async for item in queue takes items until it is closed and drained'''
+
+    empty_error = QueueEmpty
+    full_error = QueueFull
+    closed_error = QueueClosed
+
+    def __init__(self, capacity=None):
+        '''Creates an empty queue, capacity None for no limit'''
+        QueueBase.__init__(self)
+        buffer = QueueRingBuffer()
+        AsyncCollection.__init__(self, buffer, buffer.enqueue, buffer.dequeue, capacity,
+                                 buffer.requeue_front)
+
+    # Awaitable enqueue(item)/dequeue() and non-blocking variants
+    enqueue = AsyncCollection.put
+    dequeue = AsyncCollection.take
+    enqueue_nowait = AsyncCollection.put_nowait
+    dequeue_nowait = AsyncCollection.take_nowait
 
 class QueueLinkedList(QueueBase):
     '''Implements Queue using a linked list'''
@@ -133,23 +400,28 @@ class QueueLinkedList(QueueBase):
         super(QueueLinkedList, self).__init__()
         self.items = LinkedList()
 
+    def __iter__(self):
+        '''Iterates from the oldest item to the newest without copying'''
+        return iter(self.items)
+
+    def __len__(self):
+        return self.items.count
+
     def enqueue(self, item):
         '''Adds an item to the stack'''
         self.items.push_back(item)
         
     def dequeue(self):
         '''Pops the most recently added item off stack'''
-        node = self.items.pop_front()
-        return node
+        return self.items.pop_front()
         
     def is_empty(self):
-        '''Is the stack empty?'''
-        empty = (self.size() == 0)
-        return empty
+        '''Is the queue empty?'''
+        return self.items.count == 0
 
     def size(self):
-        '''How many items are in the stack'''
-        return self.items.size()
+        '''How many items are in the queue'''
+        return self.items.count
 
 def string_test(queues):
     '''Runs a queue-of-strings test on the queues input tuple'''
@@ -175,11 +447,362 @@ def string_test(queues):
         
         print('Test passed: {}'.format(passed))
 
+def iteration_test(queues):
+    '''Checks iteration is oldest first and fails fast on changes, on the queues input tuple'''
+    for queue in queues:
+        # AsyncQueue's enqueue and dequeue are coroutines, use its non-blocking ones
+        enqueue = getattr(queue, 'enqueue_nowait', queue.enqueue)
+        dequeue = getattr(queue, 'dequeue_nowait', queue.dequeue)
+        for item in range(12): # Wraps round the ring buffer
+            enqueue(item)
+        for _ in range(7):
+            dequeue()
+        assert list(queue) == [7, 8, 9, 10, 11] and len(queue) == 5, 'Iteration mismatch on {}'.format(queue)
+        for change in (lambda: enqueue(12), dequeue):
+            try:
+                for item in queue:
+                    change()
+                assert False, 'Changing {} during iteration did not fail'.format(queue)
+            except RuntimeError:
+                pass
+
+        # A change between iter() and the first item fails too, like a dict
+        items = iter(queue)
+        enqueue(13)
+        try:
+            list(items)
+            assert False, 'Changing {} after iter() did not fail'.format(queue)
+        except RuntimeError:
+            pass
+    print('Test passed: True')
+
+def ring_buffer_test():
+    '''Checks QueueRingBuffer against a list through wrap-round, resizes and bulk calls'''
+    queue = QueueRingBuffer()
+    expected = list()
+    next_item = 0
+    for step in range(2000):
+        if step % 7 == 3:
+            batch = list(range(next_item, next_item + step % 23))
+            queue.enqueue_many(batch)
+            expected.extend(batch)
+            next_item += len(batch)
+        elif step % 5 == 4 and expected:
+            n = min(len(expected), step % 31)
+            assert queue.dequeue_many(n) == expected[:n], 'dequeue_many mismatch at step {}'.format(step)
+            del expected[:n]
+        elif step % 3 == 0 and expected:
+            assert queue.dequeue() == expected.pop(0), 'dequeue mismatch at step {}'.format(step)
+        elif step % 11 == 1:
+            queue.requeue_front(next_item)
+            expected.insert(0, next_item)
+            next_item += 1
+        else:
+            queue.enqueue(next_item)
+            expected.append(next_item)
+            next_item += 1
+
+        assert queue.size() == len(expected) and queue.to_list() == expected, 'Queue contents mismatch at step {}'.format(step)
+        assert list(queue) == expected and len(queue) == len(expected), 'Iteration mismatch at step {}'.format(step)
+        assert len(queue.items) >= QueueRingBuffer.MIN_CAPACITY, 'Capacity below minimum'
+        assert queue.size() == 0 or len(queue.items) < 4 * queue.size() + QueueRingBuffer.MIN_CAPACITY, 'Capacity not halved'
+
+    queue.enqueue_many(range(5))
+    try:
+        queue.dequeue_many(-1)
+        assert False, 'dequeue_many of a negative count did not fail'
+    except ValueError:
+        pass
+    assert queue.to_list() == expected + list(range(5)), 'dequeue_many of a negative count changed the queue'
+
+    print('Test passed: True')
+
+def blocking_queue_test():
+    '''Checks BlockingQueue timeouts, close/drain and many threads sharing one queue'''
+    queue = BlockingQueue(capacity=3)
+    try:
+        queue.dequeue(timeout=0.01)
+        assert False, 'dequeue from empty queue did not time out'
+    except QueueEmpty:
+        pass
+
+    queue.enqueue_many(['to', 'be', 'or'])
+    for block, timeout in ((False, None), (True, 0.01)):
+        try:
+            queue.enqueue('not', block=block, timeout=timeout)
+            assert False, 'enqueue on full queue did not fail'
+        except QueueFull:
+            pass
+    assert queue.dequeue_many(2) == ['to', 'be'], 'dequeue_many mismatch'
+
+    # A blocked producer finishes once a consumer makes room
+    producer = threading.Thread(target=queue.enqueue_many, args=(['not', 'to', 'be'],))
+    producer.start()
+    result = [queue.dequeue(timeout=1.0) for _ in range(4)]
+    producer.join()
+    assert result == ['or', 'not', 'to', 'be'], 'Actual {}'.format(result)
+
+    queue.enqueue('that')
+    queue.close()
+    try:
+        queue.enqueue('is')
+        assert False, 'enqueue on closed queue did not fail'
+    except QueueClosed:
+        pass
+    assert queue.drain() == ['that'] and queue.is_empty(), 'drain mismatch'
+    try:
+        queue.dequeue()
+        assert False, 'dequeue on closed and drained queue did not fail'
+    except QueueClosed:
+        pass
+
+    # Every item produced is consumed exactly once, in order per producer
+    received = dict()
+    producers = 4
+    per_producer = 5000
+    queue = BlockingQueue(capacity=16)
+
+    def produce(producer):
+        for idx in range(per_producer):
+            queue.enqueue((producer, idx))
+
+    def consume(consumer, batch):
+        items = received.setdefault(consumer, list())
+        while True:
+            try:
+                items.extend(queue.dequeue_many(batch) if batch > 1 else [queue.dequeue()])
+            except QueueClosed:
+                return
+
+    producer_threads = [threading.Thread(target=produce, args=(idx,)) for idx in range(producers)]
+    consumer_threads = [threading.Thread(target=consume, args=(idx, idx + 1)) for idx in range(3)]
+    for thread in producer_threads + consumer_threads:
+        thread.start()
+    for thread in producer_threads:
+        thread.join()
+    queue.close()
+    for thread in consumer_threads:
+        thread.join()
+
+    items = [item for consumer in received.values() for item in consumer]
+    assert sorted(items) == [(p, idx) for p in range(producers) for idx in range(per_producer)], 'Items lost or duplicated'
+    for consumer in received.values():
+        for producer in range(producers):
+            order = [idx for p, idx in consumer if p == producer]
+            assert order == sorted(order), 'Items from one producer out of order'
+
+    print('Test passed: True')
+
+def async_queue_test():
+    '''Checks AsyncQueue capacity, fair wakeup, cancellation and async iteration'''
+
+    async def run():
+        queue = AsyncQueue(capacity=2)
+        await queue.enqueue('to')
+        await queue.enqueue('be')
+        try:
+            queue.enqueue_nowait('or')
+            assert False, 'enqueue_nowait on full queue did not fail'
+        except QueueFull:
+            pass
+        blocked = asyncio.ensure_future(queue.enqueue('or'))
+        await asyncio.sleep(0)
+        assert not blocked.done(), 'enqueue on full queue did not wait'
+        assert await queue.dequeue() == 'to'
+        await blocked
+        assert queue.items.to_list() == ['be', 'or'], 'Queue contents {}'.format(queue)
+
+        # Waiting takers are served oldest first, and a newcomer can't jump the line
+        queue = AsyncQueue()
+        order = list()
+
+        async def taker(name):
+            order.append((name, await queue.dequeue()))
+
+        takers = [asyncio.ensure_future(taker(name)) for name in range(3)]
+        await asyncio.sleep(0)
+        for item in ('not', 'to', 'be'):
+            queue.enqueue_nowait(item)
+        try:
+            queue.dequeue_nowait()
+            assert False, 'dequeue_nowait took an item handed to a waiting taker'
+        except QueueEmpty:
+            pass
+        await asyncio.gather(*takers)
+        assert order == [(0, 'not'), (1, 'to'), (2, 'be')], 'Wakeup order {}'.format(order)
+
+        # A taker that timed out doesn't swallow a later item
+        try:
+            await asyncio.wait_for(queue.dequeue(), 0.01)
+            assert False, 'dequeue from empty queue did not wait'
+        except asyncio.TimeoutError:
+            pass
+        queue.enqueue_nowait('that')
+        assert queue.dequeue_nowait() == 'that', 'Item lost to a cancelled taker'
+
+        # A taker cancelled after being handed an item puts it back on the front
+        taker = asyncio.ensure_future(queue.dequeue())
+        await asyncio.sleep(0)
+        queue.enqueue_nowait('first')
+        queue.enqueue_nowait('second')
+        taker.cancel()
+        try:
+            await taker
+        except asyncio.CancelledError:
+            pass
+        assert [queue.dequeue_nowait() for _ in range(2)] == ['first', 'second'], 'Cancelled taker broke FIFO order'
+
+        # async for drains the queue then stops once it is closed
+        for item in range(5):
+            queue.enqueue_nowait(item)
+        queue.close()
+        assert [item async for item in queue] == list(range(5)), 'async for mismatch'
+
+    asyncio.run(run())
+    print('Test passed: True')
+
+def benchmark_queues(sizes=(10**3, 10**4, 10**5, 10**6, 10**7), time_limit=10.0):
+    '''
+    Times enqueuing then dequeuing n items on each queue. A queue is skipped
+    for the larger sizes once even linear growth from its last time would
+    take longer than time_limit (QueueList's pop(0) is quadratic)
+    INPUT: Tuple of queue sizes, seconds allowed per run
+    RETURNS: None
+    '''
+    def one_at_a_time(queue, n):
+        enqueue = queue.enqueue
+        dequeue = queue.dequeue
+        for item in range(n):
+            enqueue(item)
+        for _ in range(n):
+            dequeue()
+
+    def bulk(queue, n):
+        queue.enqueue_many(range(n))
+        queue.dequeue_many(n)
+
+    cases = (('QueueList', QueueList, one_at_a_time),
+             ('QueueLinkedList', QueueLinkedList, one_at_a_time),
+             ('QueueRingBuffer', QueueRingBuffer, one_at_a_time),
+             ('QueueRingBuffer (bulk)', QueueRingBuffer, bulk))
+    for name, queue_class, run in cases:
+        for idx, n in enumerate(sizes):
+            start = default_timer()
+            run(queue_class(), n)
+            time = default_timer() - start
+            print('{:24} n = {:>8} - {:.3f}s, {:.0f} ops/s'.format(name, n, time, 2 * n / time))
+            if idx + 1 < len(sizes) and time * sizes[idx + 1] / n > time_limit:
+                print('{:24} skipping larger sizes'.format(name))
+                break
+
+def benchmark_contention(n=200000, threads=((1, 1), (1, 4), (4, 1), (4, 4), (8, 8)),
+                         batches=(1, 64), capacity=1024):
+    '''
+    Times n items passing through a BlockingQueue for each mix of producer
+    and consumer threads, one item per lock acquisition and in batches
+    INPUT: Number of items, tuple of (producers, consumers) pairs, tuple of
+           batch sizes, queue capacity
+    RETURNS: None
+    '''
+    for batch in batches:
+        for producers, consumers in threads:
+            queue = BlockingQueue(capacity)
+            counts = [0] * consumers
+
+            def produce(count):
+                if batch == 1:
+                    enqueue = queue.enqueue
+                    for item in range(count):
+                        enqueue(item)
+                else:
+                    for start in range(0, count, batch):
+                        queue.enqueue_many(range(start, min(count, start + batch)))
+
+            def consume(consumer):
+                dequeue = queue.dequeue
+                dequeue_many = queue.dequeue_many
+                try:
+                    while True:
+                        if batch == 1:
+                            dequeue()
+                            counts[consumer] += 1
+                        else:
+                            counts[consumer] += len(dequeue_many(batch))
+                except QueueClosed:
+                    pass
+
+            producer_threads = [threading.Thread(target=produce, args=(n // producers,))
+                                for _ in range(producers)]
+            consumer_threads = [threading.Thread(target=consume, args=(idx,))
+                                for idx in range(consumers)]
+            start = default_timer()
+            for thread in producer_threads + consumer_threads:
+                thread.start()
+            for thread in producer_threads:
+                thread.join()
+            queue.close()
+            for thread in consumer_threads:
+                thread.join()
+            time = default_timer() - start
+
+            assert sum(counts) == producers * (n // producers), 'Items lost'
+            print('BlockingQueue batch {:>3}, {} producers, {} consumers - {:.3f}s, {:.0f} items/s'.format(
+                batch, producers, consumers, time, sum(counts) / time))
+
+def benchmark_async_latency(coroutines=(10, 100, 1000, 5000), items_each=20, capacity=100):
+    '''
+    Times items passing through one bounded queue shared by n producer and
+    n consumer coroutines, for AsyncQueue and asyncio.Queue. Latency is
+    from the start of enqueue to the end of dequeue
+    INPUT: Tuple of coroutine counts, items per producer, queue capacity
+    RETURNS: None
+    '''
+    cases = (('AsyncQueue', lambda: AsyncQueue(capacity), 'enqueue', 'dequeue'),
+             ('asyncio.Queue', lambda: asyncio.Queue(capacity), 'put', 'get'))
+
+    async def run(create, put_name, get_name, n):
+        queue = create()
+        put = getattr(queue, put_name)
+        get = getattr(queue, get_name)
+        latencies = list()
+
+        async def produce():
+            for _ in range(items_each):
+                await put(default_timer())
+
+        async def consume():
+            for _ in range(items_each):
+                sent = await get()
+                latencies.append(default_timer() - sent)
+
+        start = default_timer()
+        await asyncio.gather(*[produce() for _ in range(n)], *[consume() for _ in range(n)])
+        return default_timer() - start, sorted(latencies)
+
+    for name, create, put_name, get_name in cases:
+        for n in coroutines:
+            time, latencies = asyncio.run(run(create, put_name, get_name, n))
+            percentile = lambda p: 1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+            print('{:14} {:>5} producers/consumers - {:.0f} items/s, latency p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms'.format(
+                name, n, len(latencies) / time, percentile(0.5), percentile(0.99), 1000 * latencies[-1]))
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv
     
-    string_test((QueueLinkedList(), QueueList()))
+    # Benchmark the queues with:
+    #   python ch1.3_queues.py bench
+    if argv[1:] == ['bench']:
+        benchmark_queues()
+        benchmark_contention()
+        benchmark_async_latency()
+        return 0
+
+    string_test((QueueLinkedList(), QueueList(), QueueRingBuffer(), BlockingQueue()))
+    ring_buffer_test()
+    blocking_queue_test()
+    async_queue_test()
+    iteration_test((QueueList(), QueueRingBuffer(), QueueLinkedList(), BlockingQueue(), AsyncQueue()))
     
     
 if __name__ == '__main__':
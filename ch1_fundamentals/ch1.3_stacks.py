@@ -1,5 +1,13 @@
 # Stack of strings class
+import asyncio
 import sys
+import tracemalloc
+
+from array import array
+from timeit import default_timer
+
+from async_collection import AsyncCollection
+from linked_list import LinkedList
 
 class StackBase(object):
     '''Abstract Stack of Strings class'''
@@ -31,14 +39,35 @@ class StackOfStringsList(StackBase):
         '''Creates and new Stack'''
         super(StackOfStringsList, self).__init__()
         self.items = list()
+        self.modifications = 0 # Bumped on every push/pop so iterators can fail fast
+
+    def __iter__(self):
+        '''Iterates from the newest item to the oldest without copying. Raises
+        RuntimeError if the stack is pushed or popped during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('stack changed during iteration')
+        items = self.items
+        for idx in range(len(items) - 1, -1, -1):
+            yield items[idx]
+            if self.modifications != modifications:
+                raise RuntimeError('stack changed during iteration')
+
+    def __len__(self):
+        return len(self.items)
 
     def push(self, item):
         '''Adds an item to the stack'''
         self.items.append(item)
+        self.modifications += 1
         
     def pop(self):
         '''Pops the most recently added item off stack'''
         item = self.items.pop()
+        self.modifications += 1
         return item
         
     def is_empty(self):
@@ -50,90 +79,185 @@ class StackOfStringsList(StackBase):
         '''How many items are in the stack'''
         return len(self.items)
 
-class LinkedListNode(object):
-    '''Node inside a linked list'''
-    def __init__(self, item, next_node):
-        self.item = item
-        self.next_node = next_node
-            
-    def __repr__(self):
-        return 'Item: {}, ptr: {}'.format(self.item, self.next_node)
-    
-class LinkedList(object):
-    '''Linked List class'''
-    
-    def __init__(self, verbose=False):
-        '''Creates a new linked list with no entries initially'''
-        self.first = None
-        self.verbose = verbose
-
-    def __repr__(self):
-        '''Returns a list of all the items in the linked list'''
-        items = list()
-        node = self.first
-        while node.item is not None:
-            items.append(node.item)
-            node = node.next_node
-        return str(items)
-
-    def push_front(self, item):
-        '''Adds an item to the front of the list'''
-        old_first = self.first
-        self.first = LinkedListNode(item, old_first)
-        if self.verbose: print('After push: {}'.format(self))
-
-    def pop_front(self):
-        '''Pops the item at the front of the list'''
-        old_first = self.first
-        self.first = old_first.next_node
-        if self.verbose: print('After pop : {}'.format(self))
-        return old_first.item
-
-    def push_back(self, item):
-        '''Adds an item to the back of the list'''
-        raise NotImplementedError
-        
-    def pop_back(self):
-        '''Pops the item at the back of the list'''
-        raise NotImplementedError
-
-    def size(self):
-        ''' Check how many items are in the linked list'''
-        if self.first is None:
-            return 0
-        node = self.first
-        node_count = 0
-        
-        while node.next_node is not None:
-            node_count += 1
-            node = node.next_node
-        return node_count
-
 class StackOfStringsLinkedList(StackBase):
-    '''Implements stack using list. Newest item at highest index'''
+    '''Implements stack using a linked list. Newest item at the front'''
     
     def __init__(self):
         '''Creates and new Stack'''
         super(StackOfStringsLinkedList, self).__init__()
         self.items = LinkedList()
 
+    def __iter__(self):
+        '''Iterates from the newest item to the oldest without copying'''
+        return iter(self.items)
+
+    def __len__(self):
+        return self.items.count
+
     def push(self, item):
         '''Adds an item to the stack'''
         self.items.push_front(item)
         
     def pop(self):
         '''Pops the most recently added item off stack'''
-        node = self.items.pop_front()
-        return node
+        return self.items.pop_front()
         
     def is_empty(self):
         '''Is the stack empty?'''
-        empty = (self.size() == 0)
-        return empty
+        return self.items.count == 0
+
+    def size(self):
+        '''How many items are in the stack'''
+        return self.items.count
+
+class StackArray(StackBase):
+    '''Implements a stack of numbers using array.array with a fixed
+    typecode, so each item takes the typecode's itemsize (4-8 bytes) rather
+    than a full Python object. The array is kept longer than the stack with
+    the top at index count-1, doubling when full and halving when a quarter
+    full, so push and pop are amortised O(1)'''
+
+    MIN_CAPACITY = 8
+
+    def __init__(self, typecode='q', capacity=MIN_CAPACITY):
+        '''Creates and new Stack of typecode items (see the array module)'''
+        super(StackArray, self).__init__()
+        self.typecode = typecode
+        self.items = array(typecode, bytes(array(typecode).itemsize * max(capacity, self.MIN_CAPACITY)))
+        self.count = 0
+        self.modifications = 0 # Bumped on every push/pop so iterators can fail fast
+
+    def __repr__(self):
+        return str(self.items[:self.count].tolist())
+
+    def __iter__(self):
+        '''Iterates from the newest item to the oldest without copying. Raises
+        RuntimeError if the stack is pushed or popped during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('stack changed during iteration')
+        items = self.items
+        for idx in range(self.count - 1, -1, -1):
+            yield items[idx]
+            if self.modifications != modifications:
+                raise RuntimeError('stack changed during iteration')
+
+    def __len__(self):
+        return self.count
+
+    def resize(self, capacity):
+        '''Moves the items to an array of the given length'''
+        items = self.items
+        if capacity > len(items):
+            items.frombytes(bytes(items.itemsize * (capacity - len(items))))
+        else:
+            del items[capacity:]
+
+    def reserve(self, capacity):
+        '''Grows the array to hold at least capacity items without resizing'''
+        if capacity > len(self.items):
+            self.resize(capacity)
+
+    def push(self, item):
+        '''Adds an item to the stack'''
+        if self.count == len(self.items):
+            self.resize(2 * self.count)
+        self.items[self.count] = item
+        self.count += 1
+        self.modifications += 1
+
+    def pop(self):
+        '''Pops the most recently added item off stack'''
+        if self.count == 0:
+            raise IndexError('pop from empty stack')
+        self.count -= 1
+        self.modifications += 1
+        item = self.items[self.count]
+        if len(self.items) > self.MIN_CAPACITY and self.count <= len(self.items) // 4:
+            self.resize(max(len(self.items) // 2, self.MIN_CAPACITY))
+        return item
+
+    def peek(self):
+        '''Returns the most recently added item without popping it'''
+        if self.count == 0:
+            raise IndexError('peek at empty stack')
+        return self.items[self.count - 1]
+
+    def push_many(self, items):
+        '''Pushes all the items in order, copying them in as one slice'''
+        if not isinstance(items, array) or items.typecode != self.typecode:
+            items = array(self.typecode, items)
+        end = self.count + len(items)
+        if end > len(self.items):
+            capacity = len(self.items)
+            while end > capacity:
+                capacity *= 2
+            self.resize(capacity)
+        self.items[self.count:end] = items
+        self.count = end
+        self.modifications += 1
+
+    def pop_many(self, n):
+        '''Pops n items, returned as an array in the order pop() would give them'''
+        if n < 0:
+            raise ValueError('pop_many of negative count {}'.format(n))
+        if n > self.count:
+            raise IndexError('pop_many of {} from stack of {}'.format(n, self.count))
+        if n == 0: # The slice below would run from the top to the bottom
+            return array(self.typecode)
+        start = self.count - n
+        items = self.items[self.count - 1:start - 1 if start else None:-1]
+        self.count = start
+        self.modifications += 1
+        capacity = len(self.items)
+        while capacity > self.MIN_CAPACITY and self.count <= capacity // 4:
+            capacity //= 2
+        if capacity != len(self.items):
+            self.resize(max(capacity, self.MIN_CAPACITY))
+        return items
+
+    def is_empty(self):
+        '''Is the stack empty?'''
+        return self.count == 0
 
     def size(self):
         '''How many items are in the stack'''
-        return self.items.size()
+        return self.count
+
+class StackEmpty(IndexError):
+    '''Raised by a non-blocking pop on an empty stack'''
+
+class StackFull(Exception):
+    '''Raised by a non-blocking push on a full stack'''
+
+class StackClosed(Exception):
+    '''Raised on push to a closed stack, or pop from a closed and empty one'''
+
+class AsyncStack(AsyncCollection, StackBase):
+    '''Stack shared by asyncio coroutines, holding its items in a
+    StackOfStringsList.
+    push waits while the stack is at capacity and pop while it is empty,
+    and waiters are woken oldest first.
+    async for item in stack pops items until it is closed and empty'''
+
+    empty_error = StackEmpty
+    full_error = StackFull
+    closed_error = StackClosed
+
+    def __init__(self, capacity=None):
+        '''Creates an empty stack, capacity None for no limit'''
+        StackBase.__init__(self)
+        items = StackOfStringsList()
+        AsyncCollection.__init__(self, items, items.push, items.pop, capacity, items.push)
+
+    # Awaitable push(item)/pop() and non-blocking variants
+    push = AsyncCollection.put
+    pop = AsyncCollection.take
+    push_nowait = AsyncCollection.put_nowait
+    pop_nowait = AsyncCollection.take_nowait
 
 def string_test(stacks):
     '''Runs a stack-of-strings test on the stacks input tuple'''
@@ -159,12 +283,204 @@ def string_test(stacks):
         
         print('Test passed: {}'.format(passed))
 
+def iteration_test(stacks):
+    '''Checks iteration is newest first and fails fast on changes, on the stacks input tuple'''
+    for stack in stacks:
+        # AsyncStack's push and pop are coroutines, use its non-blocking ones
+        push = getattr(stack, 'push_nowait', stack.push)
+        pop = getattr(stack, 'pop_nowait', stack.pop)
+        for item in range(1, 6):
+            push(item)
+        pop()
+        assert list(stack) == [4, 3, 2, 1] and len(stack) == 4, 'Iteration mismatch on {}'.format(stack)
+        for change in (lambda: push(5), pop):
+            try:
+                for item in stack:
+                    change()
+                assert False, 'Changing {} during iteration did not fail'.format(stack)
+            except RuntimeError:
+                pass
+
+        # A change between iter() and the first item fails too, like a dict
+        items = iter(stack)
+        push(6)
+        try:
+            list(items)
+            assert False, 'Changing {} after iter() did not fail'.format(stack)
+        except RuntimeError:
+            pass
+    print('Test passed: True')
+
+def async_stack_test():
+    '''Runs the stack-of-strings test on an AsyncStack, then checks waiting pushes and pops'''
+
+    async def run():
+        stack = AsyncStack()
+        input = ('to','be','or','not','to', '-', 'be','-','-','that', '-', '-', '-', 'is' )
+        exp_output = ['to', 'be', 'not', 'that', 'or', 'be']
+        result = list()
+        for item in input:
+            if item == '-':
+                result.append(await stack.pop())
+            else:
+                await stack.push(item)
+        assert result == exp_output, 'Actual {}, expected {}'.format(result, exp_output)
+
+        # A pop waiting on an empty stack gets the next push
+        stack = AsyncStack(capacity=1)
+        waiting = asyncio.ensure_future(stack.pop())
+        await asyncio.sleep(0)
+        await stack.push('that')
+        assert await waiting == 'that', 'Waiting pop got the wrong item'
+
+        # A push waiting on a full stack goes in when there is room
+        await stack.push('is')
+        waiting = asyncio.ensure_future(stack.push('it'))
+        await asyncio.sleep(0)
+        assert not waiting.done(), 'push on full stack did not wait'
+        assert stack.pop_nowait() == 'is'
+        await waiting
+        assert list(stack) == ['it'] and len(stack) == 1, 'Iteration mismatch'
+        stack.close()
+        assert [item async for item in stack] == ['it'], 'async for mismatch'
+
+        # A pop cancelled after being handed an item puts it back on top
+        stack = AsyncStack()
+        waiting = asyncio.ensure_future(stack.pop())
+        await asyncio.sleep(0)
+        stack.push_nowait('first')
+        stack.push_nowait('second')
+        waiting.cancel()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        assert [stack.pop_nowait() for _ in range(2)] == ['first', 'second'], 'Cancelled pop lost its place'
+
+    asyncio.run(run())
+    print('Test passed: True')
+
+def stack_array_test():
+    '''Checks StackArray's typecode limits, capacity changes and bulk calls'''
+    # Values that don't fit the typecode are refused and leave the stack as it was
+    stack = StackArray('b')
+    stack.push_many(range(-128, 128, 51))
+    for bad in (128, 1.5):
+        try:
+            stack.push(bad)
+            assert False, 'push of {} on a b stack did not fail'.format(bad)
+        except (OverflowError, TypeError):
+            pass
+    try:
+        stack.push_many([1, 2, 300])
+        assert False, 'push_many with 300 on a b stack did not fail'
+    except OverflowError:
+        pass
+    assert list(stack) == [127, 76, 25, -26, -77, -128] and stack.size() == 6, 'Stack changed by a refused push {}'.format(stack)
+
+    # A reserved array is kept until the stack empties out, then halves per pop
+    stack = StackArray('i')
+    stack.reserve(1000)
+    assert len(stack.items) == 1000 and stack.is_empty(), 'reserve mismatch'
+    stack.reserve(10)
+    assert len(stack.items) == 1000, 'reserve of less than the capacity shrank the array'
+    stack.push_many(range(10))
+    assert len(stack.items) == 1000, 'push_many into a reserved array resized it'
+    capacities = list()
+    while stack.size() > 1:
+        stack.pop()
+        capacities.append(len(stack.items))
+    assert capacities == [500, 250, 125, 62, 31, 15, 8, 8, 8], 'Shrink after reserve {}'.format(capacities)
+    assert list(stack) == [0], 'Contents lost while shrinking'
+    stack.reserve(1000)
+    stack.push_many(range(1, 100))
+    assert stack.pop_many(95).tolist() == list(range(99, 4, -1)), 'pop_many after reserve mismatch'
+    assert list(stack) == [4, 3, 2, 1, 0] and len(stack.items) == 15, 'pop_many shrink {}'.format(len(stack.items))
+
+    # push_many converts arrays of another typecode, and refuses lossy ones
+    stack = StackArray('d')
+    stack.push_many(array('i', (1, 2, 3)))
+    assert stack.items.typecode == 'd' and list(stack) == [3.0, 2.0, 1.0], 'push_many from an i array mismatch'
+    stack = StackArray('i')
+    try:
+        stack.push_many(array('d', (1.5,)))
+        assert False, 'push_many of floats on an i stack did not fail'
+    except TypeError:
+        pass
+    assert stack.is_empty(), 'Stack changed by a refused push_many'
+
+    # peek sees the new top after pop_many, and fails once it empties the stack
+    stack.push_many(array('i', range(10)))
+    assert stack.pop_many(3).tolist() == [9, 8, 7] and stack.peek() == 6, 'peek after pop_many mismatch'
+    assert stack.pop_many(7).tolist() == [6, 5, 4, 3, 2, 1, 0], 'pop_many of the rest mismatch'
+    for empty_op in (stack.peek, stack.pop, lambda: stack.pop_many(1)):
+        try:
+            empty_op()
+            assert False, 'Taking from an empty stack did not fail'
+        except IndexError:
+            pass
+    assert stack.pop_many(0) == array('i') and stack.is_empty(), 'pop_many(0) from empty stack mismatch'
+    stack.push_many((1, 2))
+    assert stack.pop_many(0) == array('i') and stack.peek() == 2, 'pop_many(0) mismatch'
+    try:
+        stack.pop_many(-1)
+        assert False, 'pop_many of a negative count did not fail'
+    except ValueError:
+        pass
+    print('Test passed: True')
+
+def benchmark_stacks(n=10**6):
+    '''
+    Measures memory per item and push/pop throughput for n ints on each stack
+    INPUT: Number of items
+    RETURNS: None
+    '''
+    def one_at_a_time(stack):
+        push = stack.push
+        pop = stack.pop
+        for item in range(n):
+            push(item)
+        for _ in range(n):
+            pop()
+
+    def bulk(stack):
+        stack.push_many(range(n))
+        stack.pop_many(n)
+
+    cases = (('StackOfStringsList', StackOfStringsList, one_at_a_time),
+             ('StackOfStringsLinkedList', StackOfStringsLinkedList, one_at_a_time),
+             ('StackArray', StackArray, one_at_a_time),
+             ('StackArray (bulk)', StackArray, bulk))
+    for name, stack_class, run in cases:
+        # Memory held by the full stack, counting the int objects it keeps alive
+        tracemalloc.start()
+        stack = stack_class()
+        for item in range(n):
+            stack.push(item)
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del stack
+
+        start = default_timer()
+        run(stack_class())
+        time = default_timer() - start
+        print('{:24} n = {} - {:.1f} bytes/item, {:.3f}s, {:.0f} ops/s'.format(
+            name, n, used / n, time, 2 * n / time))
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv
     
-    
+    # Benchmark the stacks with:
+    #   python ch1.3_stacks.py bench
+    if argv[1:] == ['bench']:
+        benchmark_stacks()
+        return 0
+
     string_test((StackOfStringsList(), StackOfStringsLinkedList()))
+    stack_array_test()
+    iteration_test((StackOfStringsList(), StackOfStringsLinkedList(), StackArray(), AsyncStack()))
+    async_stack_test()
     
     
 if __name__ == '__main__':
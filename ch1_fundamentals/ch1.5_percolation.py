@@ -0,0 +1,272 @@
+# Chapter 1.5: Percolation, Monte Carlo estimate of the percolation threshold
+
+# Needed to get command line arguments
+import sys
+
+import os
+import random
+from math import sqrt
+from multiprocessing import Pool
+from timeit import default_timer
+
+from union_find_loader import load_union_find
+
+union_find = load_union_find()
+
+class Percolation(object):
+    ''' n-by-n grid of sites, each blocked or open. The system percolates when
+    an open path joins the top row to the bottom row. Two virtual sites are
+    connected to every open site in the top and bottom rows, so percolation
+    is a single connected() check between them
+    '''
+    def __init__(self, n):
+        '''
+        Creates an n-by-n grid with every site blocked
+        INPUT: Grid side n
+        '''
+        assert n > 0, 'Error - grid side must be positive, got {}'.format(n)
+        self.n = n
+        self.top = n * n
+        self.bottom = n * n + 1
+        self.open_sites = bytearray(n * n)
+        self.opened = 0
+        self.union_find = union_find.WeightedQuickUnion(N=n * n + 2, storage='array')
+
+    def __repr__(self):
+        rows = list()
+        for row in range(self.n):
+            rows.append(''.join('.' if self.is_open(row, col) else '#' for col in range(self.n)))
+        return '\n'.join(rows)
+
+    def site(self, row, col):
+        '''
+        Site index of a grid position
+        INPUT: Row and column, both from 0 to n-1
+        RETURNS: Site index
+        '''
+        assert 0 <= row < self.n and 0 <= col < self.n, 'Error - ({}, {}) outside grid'.format(row, col)
+        return row * self.n + col
+
+    def open(self, row, col):
+        '''
+        Opens a site and connects it to its open neighbours
+        INPUT: Row and column
+        RETURNS: None
+        '''
+        site = self.site(row, col)
+        if self.open_sites[site]:
+            return
+        self.open_sites[site] = 1
+        self.opened += 1
+
+        neighbours = list()
+        if row == 0:
+            neighbours.append(self.top)
+        if row == self.n - 1:
+            neighbours.append(self.bottom)
+        if row > 0 and self.open_sites[site - self.n]:
+            neighbours.append(site - self.n)
+        if row < self.n - 1 and self.open_sites[site + self.n]:
+            neighbours.append(site + self.n)
+        if col > 0 and self.open_sites[site - 1]:
+            neighbours.append(site - 1)
+        if col < self.n - 1 and self.open_sites[site + 1]:
+            neighbours.append(site + 1)
+
+        for neighbour in neighbours:
+            if not self.union_find.connected(site, neighbour):
+                self.union_find.union(site, neighbour)
+
+    def is_open(self, row, col):
+        ''' Is the site open? '''
+        return self.open_sites[self.site(row, col)] == 1
+
+    def is_full(self, row, col):
+        ''' Is the site open and connected to the top row? '''
+        return self.is_open(row, col) and self.union_find.connected(self.site(row, col), self.top)
+
+    def number_of_open_sites(self):
+        ''' How many sites are open '''
+        return self.opened
+
+    def percolates(self):
+        ''' Does an open path join the top and bottom rows? '''
+        return self.union_find.connected(self.top, self.bottom)
+
+def percolation_trial(n, seed):
+    '''
+    One Monte Carlo trial: opens random blocked sites of an n-by-n grid until
+    it percolates. Works straight on a WeightedQuickUnion's id[]/sz[] arrays
+    (with path halving) rather than through Percolation, which is the hot
+    loop of the whole estimate
+    INPUT: Grid side n, random seed for this trial
+    RETURNS: Fraction of sites open when the grid first percolated
+    '''
+    N = n * n
+    top = N
+    bottom = N + 1
+    grid = union_find.WeightedQuickUnion(N=N + 2, storage='array')
+    ids = grid.id
+    sz = grid.sz
+    open_sites = bytearray(N)
+    rng = random.Random(seed)
+    uniform = rng.random
+    last_row = N - n
+    opened = 0
+
+    while True:
+        # Drawing until a blocked site turns up is cheaper than shuffling
+        # all N sites, as only ~60% are ever opened
+        site = int(uniform() * N)
+        if open_sites[site]:
+            continue
+        open_sites[site] = 1
+        opened += 1
+
+        # The new site starts as its own root, r tracks its root as it's linked
+        r = site
+        col = site % n
+        for q in (site - n if site >= n else top,
+                  site + n if site < last_row else bottom,
+                  site - 1 if col > 0 else -1,
+                  site + 1 if col < n - 1 else -1):
+            if q < 0 or (q < N and not open_sites[q]):
+                continue
+            while ids[q] != q:
+                ids[q] = ids[ids[q]]
+                q = ids[q]
+            if q == r:
+                continue
+            if sz[r] < sz[q]:
+                r, q = q, r
+            ids[q] = r
+            sz[r] += sz[q]
+
+        # Only the new site's component changed, so it can only percolate
+        # now if that component holds both virtual sites
+        t = top
+        while ids[t] != t:
+            ids[t] = ids[ids[t]]
+            t = ids[t]
+        if t == r:
+            b = bottom
+            while ids[b] != b:
+                ids[b] = ids[ids[b]]
+                b = ids[b]
+            if b == r:
+                return opened / N
+
+def trial_worker(job):
+    ''' Pool worker, runs one trial for a (n, seed) job '''
+    n, seed = job
+    return percolation_trial(n, seed)
+
+def percolation_stats(n, trials, workers=None, seed=0, confidence_z=1.96):
+    '''
+    Estimates the percolation threshold from independent trials run across
+    a process pool. Each trial gets its own seed derived from the base seed,
+    so results don't depend on how trials are split between workers
+    INPUT: Grid side n, number of trials, worker processes (default all
+           CPUs, 1 runs in this process), base random seed, z value for the
+           confidence interval (1.96 for 95%)
+    RETURNS: Dict with mean, stddev, confidence interval and timing
+    '''
+    assert trials > 0, 'Error - need at least 1 trial, got {}'.format(trials)
+    if workers is None:
+        workers = os.cpu_count()
+
+    jobs = [(n, '{}-{}'.format(seed, trial)) for trial in range(trials)]
+    start = default_timer()
+    if workers == 1:
+        thresholds = [trial_worker(job) for job in jobs]
+    else:
+        with Pool(workers) as pool:
+            thresholds = pool.map(trial_worker, jobs, chunksize=max(1, trials // (4 * workers)))
+    time = default_timer() - start
+
+    mean = sum(thresholds) / trials
+    stddev = float('nan')
+    if trials > 1:
+        stddev = sqrt(sum((x - mean) ** 2 for x in thresholds) / (trials - 1))
+    half_width = confidence_z * stddev / sqrt(trials)
+    return {'n': n,
+            'trials': trials,
+            'mean': mean,
+            'stddev': stddev,
+            'confidence_low': mean - half_width,
+            'confidence_high': mean + half_width,
+            'time': time,
+            'thresholds': thresholds}
+
+def test_percolation():
+    '''Runs small grids with known answers'''
+
+    grid = Percolation(3)
+    assert not grid.percolates(), 'Blocked grid percolates !'
+    grid.open(0, 1)
+    grid.open(1, 1)
+    assert grid.is_full(1, 1) and not grid.percolates(), 'Half column wrong'
+    grid.open(2, 0)
+    assert not grid.is_full(2, 0) and not grid.percolates(), 'Diagonal sites connected'
+    grid.open(2, 1)
+    assert grid.is_full(2, 0) and grid.percolates(), 'Full column does not percolate'
+    assert grid.number_of_open_sites() == 4, 'Open site count wrong'
+
+    # A 1-by-1 grid percolates as soon as its only site opens
+    assert percolation_trial(1, 0) == 1.0, '1x1 threshold is not 1'
+
+    # Same seeds give the same thresholds however the trials are split
+    serial = percolation_stats(20, 8, workers=1, seed=3)
+    pooled = percolation_stats(20, 8, workers=2, seed=3)
+    assert serial['thresholds'] == pooled['thresholds'], 'Trials depend on the worker split'
+    assert all(0.0 < x <= 1.0 for x in serial['thresholds']), 'Threshold outside (0, 1]'
+
+    # Each trial's grid percolates at its threshold, not one site before
+    for seed in range(5):
+        threshold = percolation_trial(10, seed)
+        grid = Percolation(10)
+        rng = random.Random(seed)
+        while not grid.percolates():
+            site = int(rng.random() * 100)
+            grid.open(site // 10, site % 10)
+        assert grid.number_of_open_sites() / 100 == threshold, 'Trial disagrees with Percolation'
+
+    print('All tests passed')
+
+def main(argv=None):
+    '''
+    Function called to run main script including unit tests
+    INPUT: List of arguments from the command line:
+        <n> <trials> [workers] [seed]
+    RETURNS: Exit code to be passed to sys.exit():
+        -1: Invalid input
+         0: Script completed successfully
+    '''
+    if argv is None:
+        argv = sys.argv
+
+    options = argv[1:]
+    if not options:
+        test_percolation()
+        return 0
+
+    if len(options) < 2:
+        print('Error - expected <n> <trials> [workers] [seed], got {}'.format(options))
+        return -1
+
+    n = int(options[0])
+    trials = int(options[1])
+    workers = int(options[2]) if len(options) > 2 else None
+    seed = int(options[3]) if len(options) > 3 else 0
+
+    stats = percolation_stats(n, trials, workers, seed)
+    print('mean                    = {:.6f}'.format(stats['mean']))
+    print('stddev                  = {:.6f}'.format(stats['stddev']))
+    print('95% confidence interval = [{:.6f}, {:.6f}]'.format(stats['confidence_low'],
+                                                              stats['confidence_high']))
+    print('{} trials in {:.1f}s ({:.3f}s per trial)'.format(trials, stats['time'],
+                                                            stats['time'] / trials))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,25 @@
 import sys
 import random
 
+from timeit import default_timer
+
 def main(argv=None):
     """Main entry point"""
     
     if argv is None:
         argv = sys.argv
     
+    # Benchmark the Shell sort gap sequences with:
+    #   python ch2.1_elementary_sorts.py bench
+    if argv[1:] == ['bench']:
+        benchmark_shell_sort()
+        return 0
+
     # small_array = [4, 2, 3, 5, 1]
     # print(shell_sort(small_array, verbose=True))
     
-    batch_test((selection_sort, insertion_sort), n=100, runs=10)
+    batch_test((selection_sort, insertion_sort, shell_sort), n=100, runs=10)
+    shell_sort_test()
     
     return 0
 
@@ -61,27 +70,146 @@ def insertion_sort(array):
     
     return array
 
-def shell_sort(array, verbose=False):
+def knuth_gaps(N):
+    """Knuth's 3h+1 sequence: 1, 4, 13, 40, ... up to N/3"""
+    gaps = [1]
+    while gaps[-1] < N / 3.0:
+        gaps.append(3 * gaps[-1] + 1)
+    return gaps
 
-    # Need to compute the largest h value to run with first
-    N = len(array)
-    h = 1
-    while h < N / 3.0:
-        h = 3 * h + 1
-    if verbose: print('H is {}'.format(h))
-    
-    # Now do insertion sort, jumping by h instead of 1
-    while h >= 1:
-        for i in range(1, N, h):
-            if array[i] < array[i-1]:
-                array = swap(array, i, i-1)
-            
-        h = h / 3
-    return array     
-    
-    
+def sedgewick_gaps(N):
+    """Sedgewick's 1986 sequence: 1, 8, 23, 77, 281, ... (4^k + 3*2^(k-1) + 1)"""
+    gaps = [1]
+    k = 1
+    while 4 ** k + 3 * 2 ** (k - 1) + 1 < N:
+        gaps.append(4 ** k + 3 * 2 ** (k - 1) + 1)
+        k += 1
+    return gaps
+
+def tokuda_gaps(N):
+    """Tokuda's sequence: 1, 4, 9, 20, 46, 103, ... (ceil((9*(9/4)^k - 4)/5))"""
+    gaps = [1]
+    k = 1
+    while True:
+        # Integer form of ceil((9 * (9/4)^k - 4) / 5), exact for any k
+        gap = -(-(9 ** (k + 1) - 4 * 4 ** k) // (5 * 4 ** k))
+        if gap >= N:
+            return gaps
+        gaps.append(gap)
+        k += 1
+
+CIURA_GAPS = (1, 4, 10, 23, 57, 132, 301, 701, 1750)
+
+def ciura_gaps(N):
+    """Ciura's empirical sequence, extended past 1750 by multiplying by 2.25"""
+    gaps = [gap for gap in CIURA_GAPS if gap < N] or [1]
+    if len(gaps) == len(CIURA_GAPS):
+        while int(gaps[-1] * 2.25) < N:
+            gaps.append(int(gaps[-1] * 2.25))
+    return gaps
+
+GAP_SEQUENCES = {'knuth': knuth_gaps,
+                 'sedgewick': sedgewick_gaps,
+                 'tokuda': tokuda_gaps,
+                 'ciura': ciura_gaps}
+
+def h_sort(array, h):
+    """Gapped insertion sort: sorts each of the h interleaved subsequences.
+    Items are shifted along rather than swapped, so each step is one write"""
+    for i in range(h, len(array)):
+        item = array[i]
+        j = i
+        while j >= h:
+            prev = array[j - h]
+            if not item < prev:
+                break
+            array[j] = prev
+            j -= h
+        array[j] = item
+
+def h_sort_counted(array, h, counts):
+    """h_sort that also adds its compares and exchanges (shifts) to counts"""
+    compares = 0
+    exchanges = 0
+    for i in range(h, len(array)):
+        item = array[i]
+        j = i
+        while j >= h:
+            prev = array[j - h]
+            compares += 1
+            if not item < prev:
+                break
+            array[j] = prev
+            exchanges += 1
+            j -= h
+        array[j] = item
+    counts['compares'] += compares
+    counts['exchanges'] += exchanges
+
+def shell_sort(array, gaps='knuth', counts=None, verbose=False):
+    """
+    Shell sort: h-sorts the array for each gap in a decreasing sequence,
+    ending with h = 1 (plain insertion sort on a nearly sorted array)
+    INPUT: List to sort in place, gap sequence name from GAP_SEQUENCES,
+           optional dict that gets 'compares' and 'exchanges' totals, where
+           an exchange is one item shifted by h
+    RETURNS: The sorted list
+    """
+    gap_list = GAP_SEQUENCES[gaps](len(array))
+    if verbose: print('Gaps are {}'.format(gap_list[::-1]))
+
+    if counts is not None:
+        counts['compares'] = 0
+        counts['exchanges'] = 0
+    for h in reversed(gap_list):
+        if counts is None:
+            h_sort(array, h)
+        else:
+            h_sort_counted(array, h, counts)
+    return array
+
+def shell_sort_test():
+    """Checks the gap sequences and every one of them sorts"""
+    assert knuth_gaps(1000) == [1, 4, 13, 40, 121, 364]
+    assert sedgewick_gaps(1000) == [1, 8, 23, 77, 281]
+    assert tokuda_gaps(1000) == [1, 4, 9, 20, 46, 103, 233, 525]
+    assert ciura_gaps(5000) == [1, 4, 10, 23, 57, 132, 301, 701, 1750, 3937]
+
+    for gaps in GAP_SEQUENCES:
+        for n in (0, 1, 2, 10, 1000):
+            for arr in (random.sample(range(10 * n), n), list(range(n, 0, -1)),
+                        [random.randrange(3) for _ in range(n)]):
+                counts = dict()
+                assert shell_sort(list(arr), gaps, counts) == sorted(arr), 'shell_sort {} failed'.format(gaps)
+                assert counts['compares'] >= counts['exchanges'] >= 0
+    print('Test passed: True')
+
+def shell_sort_inputs(n):
+    """Benchmark inputs of n integers"""
+    return (('random', random.sample(range(10 * n), n)),
+            ('sorted', list(range(n))),
+            ('reversed', list(range(n, 0, -1))),
+            ('few unique', [random.randrange(10) for _ in range(n)]))
+
+def benchmark_shell_sort(sizes=(10**4, 10**5, 10**6)):
+    """
+    Times every gap sequence on each input, then counts compares and
+    exchanges in a second run (counting slows the loop down)
+    INPUT: Tuple of array sizes
+    RETURNS: None
+    """
+    for n in sizes:
+        for name, arr in shell_sort_inputs(n):
+            for gaps in GAP_SEQUENCES:
+                work = list(arr)
+                start = default_timer()
+                shell_sort(work, gaps)
+                time = default_timer() - start
+                counts = dict()
+                shell_sort(list(arr), gaps, counts)
+                print('n = {:>7} {:10} {:9} - {:.3f}s, {:>11} compares, {:>11} exchanges'.format(
+                    n, name, gaps, time, counts['compares'], counts['exchanges']))
 
-            
 if __name__ == "__main__":
     
     sys.exit(main(sys.argv))
\ No newline at end of file
@@ -1,14 +1,41 @@
 import sys
 import random
 
+import heapq
+import os
+import tempfile
+from array import array
+from timeit import default_timer
+
 def main(argv=None):
     """Main entry point"""
     
     if argv is None:
         argv = sys.argv
     
+    # Benchmark the merge sorts with:
+    #   python ch2.2_merge_sort.py bench
+    if argv[1:] == ['bench']:
+        benchmark_merge_sort()
+        return 0
+
+    # Sort a file of integers too large for memory with:
+    #   python ch2.2_merge_sort.py sort <input> <output> [memory MB] [fan-in]
+    if argv[1:2] == ['sort']:
+        if len(argv) < 4:
+            print('Error - expected sort <input> <output> [memory MB] [fan-in], got {}'.format(argv[1:]))
+            return -1
+        memory_bytes = int(float(argv[4]) * (1 << 20)) if len(argv) > 4 else 64 << 20
+        fan_in = int(argv[5]) if len(argv) > 5 else 64
+        stats = external_sort(argv[2], argv[3], memory_bytes, fan_in)
+        print('Sorted {} integers in {:.2f}s: {} runs, {} merge passes'.format(
+            stats['items'], stats['time'], stats['runs'], stats['passes']))
+        print('I/O {:.2f}s, CPU {:.2f}s'.format(stats['io_time'], stats['cpu_time']))
+        return 0
+
     print(merge_sort([6,3,5,8,2,6,2,5,8,0,5,3,2]))
-    # batch_test((selection_sort, insertion_sort), n=100, runs=10)
+    merge_sort_test()
+    external_sort_test()
     
     return 0
 
@@ -25,52 +52,402 @@ def batch_test(algos, n, runs, max=None):
     return
 
 
-def merge_sort(array):
-    final_array = sort(array)
-    return final_array
+# Subarrays this short are insertion sorted instead of split further
+CUTOFF = 8
 
-def sort(array, verbose=False):
-    #If we're down to one element it's already sorted.
-    if len(array) == 1:
-        return array
-        
-    mid = int(len(array) / 2)
-    print('mid = {}, left = {}, right = {}'.format(mid, array[:mid], array[mid:]))
-    
-    lista = sort(array[:mid])
-    listb = sort(array[mid:])
-    result = merge(lista, listb, verbose=True)
-    return result
+def merge_sort(array, method='top_down'):
+    """
+    Sorts a list in place with merge sort, using one auxiliary list
+    allocated up front and reused by every merge
+    INPUT: List to sort, 'top_down' (recursive) or 'bottom_up' (passes of
+           doubling width)
+    RETURNS: The sorted list
+    """
+    if len(array) <= CUTOFF:
+        insertion_sort(array, 0, len(array))
+    elif method == 'top_down':
+        sort(list(array), array, 0, len(array))
+    elif method == 'bottom_up':
+        sort_bottom_up(array, [None] * len(array))
+    else:
+        raise ValueError('Unknown merge sort method {}'.format(method))
+    return array
+
+def insertion_sort(array, lo, hi):
+    """Insertion sorts array[lo:hi] in place"""
+    for i in range(lo + 1, hi):
+        item = array[i]
+        j = i
+        while j > lo:
+            prev = array[j - 1]
+            if not item < prev:
+                break
+            array[j] = prev
+            j -= 1
+        array[j] = item
+
+def copy_range(src, dst, lo, hi):
+    """Copies src[lo:hi] to dst[lo:hi] without building a slice"""
+    for k in range(lo, hi):
+        dst[k] = src[k]
+
+def merge_range(src, dst, lo, mid, hi):
+    """
+    Merges the sorted runs src[lo:mid] and src[mid:hi] into dst[lo:hi].
+    Equal items are taken from the left run first, so the sort is stable
+    INPUT: Source and destination lists, run boundaries (lo < mid < hi)
+    RETURNS: None
+    """
+    i = lo
+    j = mid
+    left = src[i]
+    right = src[j]
+    for k in range(lo, hi):
+        if right < left:
+            dst[k] = right
+            j += 1
+            if j == hi:
+                for k in range(k + 1, hi): # The rest of the left run
+                    dst[k] = src[i]
+                    i += 1
+                return
+            right = src[j]
+        else:
+            dst[k] = left
+            i += 1
+            if i == mid:
+                copy_range(src, dst, j, hi) # The rest of the right run, at the same indices
+                return
+            left = src[i]
+
+def sort(src, dst, lo, hi):
+    """
+    Top-down merge sort of dst[lo:hi]. src[lo:hi] holds the same items on
+    entry and is used as scratch: the halves are sorted into src, swapping
+    the roles of the two lists at each level, then merged back into dst,
+    so no level copies its input before merging
+    INPUT: Scratch and destination lists, range to sort
+    RETURNS: None
+    """
+    if hi - lo <= CUTOFF:
+        insertion_sort(dst, lo, hi)
+        return
+    mid = (lo + hi) // 2
+    sort(dst, src, lo, mid)
+    sort(dst, src, mid, hi)
+    if not src[mid] < src[mid - 1]:
+        copy_range(src, dst, lo, hi) # Halves already in order, skip the merge
+    else:
+        merge_range(src, dst, lo, mid, hi)
+
+def sort_bottom_up(array, aux):
+    """
+    Bottom-up merge sort: insertion sorts blocks of CUTOFF items, then
+    merges runs of doubling width, each pass going from one list into the
+    other. Runs already in order are copied across without merging
+    INPUT: List to sort in place, auxiliary list of the same length
+    RETURNS: None
+    """
+    n = len(array)
+    for lo in range(0, n, CUTOFF):
+        insertion_sort(array, lo, min(lo + CUTOFF, n))
+
+    src, dst = array, aux
+    width = CUTOFF
+    while width < n:
+        for lo in range(0, n, 2 * width):
+            mid = min(lo + width, n)
+            hi = min(lo + 2 * width, n)
+            if mid == hi or not src[mid] < src[mid - 1]:
+                copy_range(src, dst, lo, hi)
+            else:
+                merge_range(src, dst, lo, mid, hi)
+        src, dst = dst, src
+        width *= 2
+    if src is not array:
+        array[:] = src
 
-def merge(lista, listb, verbose=False):
-    """Merges two lists together"""
+def merge(lista, listb):
+    """Merges two sorted lists into a new sorted list"""
+    len_a = len(lista)
+    len_b = len(listb)
+    if not len_a or not len_b:
+        return list(lista) + list(listb)
+
+    output = [None] * (len_a + len_b)
     ptra = 0
     ptrb = 0
-    
-    if verbose: print('\na = {}, b = {}'.format(lista, listb))
-    output = list()
-    while ptra < len(lista) or ptrb < len(listb):
-        if ptra == len(lista):
-            output.extend(listb[ptrb:])  
-            ptrb = len(listb)
-        elif ptrb == len(listb):
-            output.extend(lista[ptra:])  
-            ptra = len(lista)
-        elif lista[ptra] <= listb[ptrb]:
-            output.append(lista[ptra])
-            ptra += 1
-        elif lista[ptra] > listb[ptrb]:
-            output.append(listb[ptrb])
+    a = lista[0]
+    b = listb[0]
+    for k in range(len_a + len_b):
+        if b < a:
+            output[k] = b
             ptrb += 1
-        
-        if verbose: print('ptra = {}, lista = {}, ptrb = {}, listb = {}, output = {}'.format(ptra, lista, ptrb, listb, output))
-    
-    if verbose: print('output = {}'.format(output))
-    return output
-        
-    
-    
-            
+            if ptrb == len_b:
+                output[k + 1:] = lista[ptra:]
+                return output
+            b = listb[ptrb]
+        else:
+            output[k] = a
+            ptra += 1
+            if ptra == len_a:
+                output[k + 1:] = listb[ptrb:]
+                return output
+            a = lista[ptra]
+
+def read_int_chunks(filename, chunk_items, stats, read_bytes=1 << 20):
+    """
+    Reads a text file of integers (one per line, like 1Mints.txt) in
+    chunks of chunk_items. Lines are read and parsed read_bytes at a time
+    into a compact 64-bit array, so the text of a whole chunk is never
+    held at once
+    INPUT: string with filename, integers per chunk, stats dict to add
+           'io_time' (reading) and 'cpu_time' (parsing) to, bytes per read
+    RETURNS: Generator of array('q') chunks
+    """
+    chunk = array('q')
+    with open(filename, 'r') as f:
+        while True:
+            start = default_timer()
+            lines = f.readlines(read_bytes)
+            parsed = default_timer()
+            stats['io_time'] += parsed - start
+            if not lines:
+                break
+            chunk.extend(int(line) for line in lines if not line.isspace())
+            stats['cpu_time'] += default_timer() - parsed
+            while len(chunk) >= chunk_items:
+                yield chunk[:chunk_items]
+                del chunk[:chunk_items]
+    if chunk:
+        yield chunk
+
+def write_run(run_dir, idx, items, stats):
+    """
+    Spills sorted integers to a binary run file of 64-bit values
+    INPUT: Directory for the run, run number, iterable of sorted integers,
+           stats dict
+    RETURNS: string with run filename
+    """
+    filename = os.path.join(run_dir, 'run{}.bin'.format(idx))
+    start = default_timer()
+    values = items if isinstance(items, array) else array('q', items)
+    packed = default_timer()
+    with open(filename, 'wb') as f:
+        values.tofile(f)
+    stats['cpu_time'] += packed - start
+    stats['io_time'] += default_timer() - packed
+    return filename
+
+def read_run(filename, block_items, stats):
+    """
+    Streams a binary run back in blocks of block_items
+    INPUT: string with run filename, integers per read, stats dict
+    RETURNS: Generator of integers in run order
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            start = default_timer()
+            block = array('q')
+            try:
+                block.fromfile(f, block_items)
+            except EOFError: # Last, partial block
+                pass
+            stats['io_time'] += default_timer() - start
+            if not block:
+                return
+            yield from block
+
+def merge_runs(runs, block_items, stats):
+    """
+    k-way merge of sorted runs with a heap, the k-run generalisation of
+    merge(): each step yields the smallest of the k run heads
+    INPUT: List of run filenames, integers per read for each run, stats dict
+    RETURNS: Generator of integers in sorted order
+    """
+    return heapq.merge(*[read_run(run, block_items, stats) for run in runs])
+
+def write_ints(filename, items, block_items, stats):
+    """
+    Writes integers as text, one per line, formatting and writing a block
+    at a time
+    INPUT: string with filename, iterable of integers, integers per write,
+           stats dict
+    RETURNS: Number of integers written
+    """
+    count = 0
+    items = iter(items)
+    with open(filename, 'w') as f:
+        while True:
+            start = default_timer()
+            io_time = stats['io_time']
+            block = list(zip(range(block_items), items)) # Also pulls items from the merge
+            text = ''.join('{}\n'.format(item) for _, item in block)
+            formatted = default_timer()
+            f.write(text)
+            # Run reads during the pull are already in io_time
+            stats['cpu_time'] += formatted - start - (stats['io_time'] - io_time)
+            stats['io_time'] += default_timer() - formatted
+            count += len(block)
+            if len(block) < block_items:
+                return count
+
+def external_sort(in_filename, out_filename, memory_bytes=64 << 20, fan_in=64, tmp_dir=None):
+    """
+    Sorts a text file of integers too large for memory. Chunks that fit the
+    memory budget are sorted in memory and spilled as binary runs, then the
+    runs are merged fan_in at a time (in extra passes if there are more than
+    fan_in runs) into the output file.
+    Time spent reading and writing files is reported as io_time, and time
+    parsing, sorting, merging and formatting as cpu_time. Run reads happen
+    while a write block is pulled from the merge, so their time is taken
+    out of that block's cpu_time and only counted as io_time
+    INPUT: Input and output filenames, memory budget in bytes, most runs
+           merged at once, directory for temporary runs
+    RETURNS: Dict with the integer count, runs, merge passes and timings
+    """
+    assert fan_in >= 2, 'Error - fan_in must be at least 2, got {}'.format(fan_in)
+    stats = {'items': 0, 'runs': 0, 'passes': 0, 'io_time': 0.0, 'cpu_time': 0.0}
+    start = default_timer()
+
+    # Sorting a chunk holds it as an 8 byte array plus a list of ints
+    # (~40 bytes each) plus the 8 byte sorted array. Merge blocks are 8 bytes
+    # per item, but each item turns into an int object as it's merged
+    chunk_items = max(1, memory_bytes // 56)
+    block_items = max(1, memory_bytes // (40 * (fan_in + 1)))
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        runs = list()
+        for chunk in read_int_chunks(in_filename, chunk_items, stats):
+            sort_start = default_timer()
+            ordered = sorted(chunk)
+            stats['cpu_time'] += default_timer() - sort_start
+            stats['items'] += len(ordered)
+            del chunk
+            runs.append(write_run(run_dir, len(runs), ordered, stats))
+            del ordered
+        stats['runs'] = len(runs)
+
+        # Merge groups of fan_in runs into longer runs until one pass is left
+        next_run = len(runs)
+        while len(runs) > fan_in:
+            merged = list()
+            for idx in range(0, len(runs), fan_in):
+                group = runs[idx:idx + fan_in]
+                merged.append(write_run_stream(run_dir, next_run, merge_runs(group, block_items, stats),
+                                               block_items, stats))
+                next_run += 1
+                for run in group:
+                    os.remove(run)
+            runs = merged
+            stats['passes'] += 1
+
+        write_ints(out_filename, merge_runs(runs, block_items, stats), block_items, stats)
+        stats['passes'] += 1
+
+    stats['time'] = default_timer() - start
+    return stats
+
+def write_run_stream(run_dir, idx, items, block_items, stats):
+    """
+    Writes a merged stream of integers to a binary run a block at a time
+    INPUT: Directory for the run, run number, iterable of sorted integers,
+           integers per write, stats dict
+    RETURNS: string with run filename
+    """
+    filename = os.path.join(run_dir, 'run{}.bin'.format(idx))
+    items = iter(items)
+    with open(filename, 'wb') as f:
+        while True:
+            start = default_timer()
+            io_time = stats['io_time']
+            block = array('q', (item for _, item in zip(range(block_items), items)))
+            packed = default_timer()
+            block.tofile(f)
+            # Run reads during the pull are already in io_time
+            stats['cpu_time'] += packed - start - (stats['io_time'] - io_time)
+            stats['io_time'] += default_timer() - packed
+            if len(block) < block_items:
+                return filename
+
+def external_sort_test():
+    """Sorts a file with a tiny memory budget, forcing many runs and extra merge passes"""
+    handle, in_filename = tempfile.mkstemp(suffix='.txt')
+    out_filename = in_filename + '.sorted'
+    values = [random.randrange(-10**12, 10**12) for _ in range(5000)] + [7] * 100
+    random.shuffle(values)
+    with os.fdopen(handle, 'w') as f:
+        f.write(''.join(' {}\n'.format(value) for value in values)) # algs4 files pad with spaces
+
+    try:
+        for memory_bytes, fan_in in ((1 << 20, 64), (56 * 300, 3)):
+            stats = external_sort(in_filename, out_filename, memory_bytes, fan_in)
+            with open(out_filename) as f:
+                result = [int(line) for line in f]
+            assert result == sorted(values), 'external_sort output not sorted'
+            assert stats['items'] == len(values), 'Item count {}'.format(stats['items'])
+
+            # Each pass cuts the number of runs by a factor of fan_in
+            runs = stats['runs']
+            passes = 1
+            while runs > fan_in:
+                runs = -(-runs // fan_in)
+                passes += 1
+            assert stats['passes'] == passes, 'Merge passes {}'.format(stats)
+            assert stats['io_time'] + stats['cpu_time'] <= stats['time'], 'Time counted twice {}'.format(stats)
+        assert stats['runs'] > fan_in, 'Small memory budget did not force extra passes'
+    finally:
+        os.remove(in_filename)
+        if os.path.exists(out_filename):
+            os.remove(out_filename)
+
+    print('Test passed: True')
+
+def merge_sort_test():
+    """Checks both methods on awkward sizes and inputs, including stability"""
+    for method in ('top_down', 'bottom_up'):
+        for n in (0, 1, 2, CUTOFF, CUTOFF + 1, 100, 1000, 1023, 1025):
+            for arr in (random.sample(range(10 * n), n), list(range(n)), list(range(n, 0, -1)),
+                        [random.randrange(3) for _ in range(n)]):
+                assert merge_sort(list(arr), method) == sorted(arr), '{} failed on {}'.format(method, arr)
+
+        # Items compare by key only, so a stable sort keeps equal keys in input order
+        items = [Keyed(random.randrange(10), idx) for idx in range(500)]
+        result = merge_sort(list(items), method)
+        assert [(item.key, item.idx) for item in result] == sorted((item.key, item.idx) for item in items), '{} is not stable'.format(method)
+
+    assert merge([1, 3, 5], [2, 3, 4, 6]) == [1, 2, 3, 3, 4, 5, 6]
+    assert merge([], [1, 2]) == [1, 2] and merge([1], []) == [1]
+    print('Test passed: True')
+
+class Keyed(object):
+    """Test item ordered by key alone"""
+    def __init__(self, key, idx):
+        self.key = key
+        self.idx = idx
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+def benchmark_merge_sort(sizes=(10**4, 10**5, 10**6)):
+    """
+    Times both merge sort methods against the built-in sorted()
+    INPUT: Tuple of array sizes
+    RETURNS: None
+    """
+    cases = (('top_down', lambda arr: merge_sort(arr, 'top_down')),
+             ('bottom_up', lambda arr: merge_sort(arr, 'bottom_up')),
+             ('sorted()', sorted))
+    for n in sizes:
+        inputs = (('random', random.sample(range(10 * n), n)), ('sorted', list(range(n))))
+        for input_name, arr in inputs:
+            for name, algo in cases:
+                work = list(arr)
+                start = default_timer()
+                algo(work)
+                time = default_timer() - start
+                print('n = {:>7} {:6} {:9} - {:.3f}s'.format(n, input_name, name, time))
+
 if __name__ == "__main__":
     
     sys.exit(main(sys.argv))
\ No newline at end of file
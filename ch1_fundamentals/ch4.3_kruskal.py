@@ -0,0 +1,254 @@
+# Chapter 4.3: Kruskal's minimum spanning forest and single-linkage clustering
+
+# Needed to get command line arguments
+import sys
+
+import heapq
+import os
+import struct
+import tempfile
+from array import array
+from timeit import default_timer
+
+from union_find_loader import load_union_find
+
+union_find = load_union_find()
+
+# Sorted runs spilled to disk hold packed little-endian (weight, v, w) records
+EDGE_RECORD = struct.Struct('<dqq')
+
+def read_weighted_edges(filename, chunk_edges=1 << 20):
+    '''
+    Reads an algs4 edge-weighted graph file (V on the first line, E on the
+    second, then one "v w weight" edge per line) in chunks
+    INPUT: string with filename, edges per chunk
+    RETURNS: Tuple of (V, E, generator of chunks). Each chunk is a tuple of
+             (vs, ws, weights) arrays
+    '''
+    f = open(filename, 'r')
+    V = int(f.readline())
+    E = int(f.readline())
+
+    def chunks():
+        with f:
+            while True:
+                lines = f.readlines(chunk_edges * 16) # ~16 bytes per line
+                if not lines:
+                    return
+                tokens = ''.join(lines).split()
+                yield (array('q', map(int, tokens[0::3])),
+                       array('q', map(int, tokens[1::3])),
+                       array('d', map(float, tokens[2::3])))
+
+    return V, E, chunks()
+
+def sort_chunk(vs, ws, weights):
+    '''
+    Sorts one chunk of edges by weight
+    INPUT: Arrays of edge endpoints and weights
+    RETURNS: List of (weight, v, w) tuples in weight order
+    '''
+    order = sorted(range(len(weights)), key=weights.__getitem__)
+    return [(weights[idx], vs[idx], ws[idx]) for idx in order]
+
+def read_run(filename, block_records=1 << 16):
+    '''
+    Streams the (weight, v, w) records of a sorted run file back in order
+    INPUT: string with run filename, records per read
+    RETURNS: Generator of (weight, v, w) tuples
+    '''
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(EDGE_RECORD.size * block_records)
+            if not block:
+                return
+            for record in EDGE_RECORD.iter_unpack(block):
+                yield record
+
+def sorted_edges(chunks, tmp_dir=None):
+    '''
+    Streams edges in weight order, sorting them externally if needed. A
+    single chunk is sorted in memory. With more chunks, each one is sorted
+    and spilled to a temporary run file, then the runs are k-way merged with
+    a heap, so memory holds one chunk plus one read block per run.
+    Closing the generator early (e.g. Kruskal's early exit) removes the runs
+    INPUT: Generator of (vs, ws, weights) chunks, directory for run files
+    RETURNS: Generator of (weight, v, w) tuples
+    '''
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None:
+        for edge in sort_chunk(*first):
+            yield edge
+        return
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        runs = [write_run(run_dir, 0, sort_chunk(*first)),
+                write_run(run_dir, 1, sort_chunk(*second))]
+        del first, second
+        for chunk in chunks:
+            runs.append(write_run(run_dir, len(runs), sort_chunk(*chunk)))
+
+        merged = heapq.merge(*[read_run(run) for run in runs])
+        try:
+            for edge in merged:
+                yield edge
+        finally:
+            merged.close()
+
+def write_run(run_dir, idx, edges):
+    '''
+    Spills a sorted chunk to a run file
+    INPUT: Directory for the run, run number, sorted (weight, v, w) tuples
+    RETURNS: string with run filename
+    '''
+    filename = os.path.join(run_dir, 'run{}.bin'.format(idx))
+    pack = EDGE_RECORD.pack
+    with open(filename, 'wb') as f:
+        f.write(b''.join(pack(*edge) for edge in edges))
+    return filename
+
+def kruskal(uf, edges, clusters=1):
+    '''
+    Kruskal's algorithm: takes edges in weight order and keeps each one that
+    joins two different components of the union-find. Stops as soon as only
+    `clusters` components are left, so with clusters=1 it exits after V-1
+    edges of a connected graph. Stopping at k > 1 gives single-linkage
+    clustering, with the clusters left in the union-find
+    INPUT: Union-find over the V vertices, (weight, v, w) edges in weight
+           order, number of components to stop at
+    RETURNS: Generator of the accepted (weight, v, w) edges
+    '''
+    find = uf.find_root
+    for weight, v, w in edges:
+        if uf.count() <= clusters:
+            return
+        v_root = find(v)
+        w_root = find(w)
+        if v_root != w_root:
+            uf.union(v_root, w_root)
+            yield weight, v, w
+
+def minimum_spanning_forest(filename, clusters=1, chunk_edges=1 << 20, tmp_dir=None, output=None):
+    '''
+    Streams an edge-weighted graph file through an external sort and
+    Kruskal's algorithm with a PathCompressUnionFind
+    INPUT: string with filename, number of clusters to stop at (1 for the
+           full minimum spanning forest), edges sorted in memory at a time,
+           directory for sorted runs, optional function called with each
+           accepted (weight, v, w) edge
+    RETURNS: Dict with the forest weight and edge count, the union-find
+             holding the components, and the timing
+    '''
+    start = default_timer()
+    V, E, chunks = read_weighted_edges(filename, chunk_edges)
+    uf = union_find.PathCompressUnionFind(N=V, storage='array')
+
+    edges = sorted_edges(chunks, tmp_dir)
+    total = 0.0
+    accepted = 0
+    try:
+        for edge in kruskal(uf, edges, clusters):
+            total += edge[0]
+            accepted += 1
+            if output is not None:
+                output(edge)
+    finally:
+        edges.close()
+
+    return {'V': V, 'E': E, 'weight': total, 'edges': accepted,
+            'components': uf.count(), 'union_find': uf,
+            'time': default_timer() - start}
+
+def single_linkage_clusters(filename, k, chunk_edges=1 << 20, tmp_dir=None):
+    '''
+    Groups the vertices into k clusters by single linkage (Kruskal stopped
+    at k components)
+    INPUT: string with filename, number of clusters, edges sorted in memory
+           at a time, directory for sorted runs
+    RETURNS: Array where entry v is the cluster label (a vertex) of v
+    '''
+    result = minimum_spanning_forest(filename, k, chunk_edges, tmp_dir)
+    return result['union_find'].roots()
+
+TINY_EWG = '''8
+16
+4 5 0.35
+4 7 0.37
+5 7 0.28
+0 7 0.16
+1 5 0.32
+0 4 0.38
+2 3 0.17
+1 7 0.19
+0 2 0.26
+1 2 0.36
+1 3 0.29
+2 7 0.34
+6 2 0.40
+3 6 0.52
+6 0 0.58
+6 4 0.93
+'''
+
+def test_kruskal():
+    '''Runs tinyEWG.txt (MST weight 1.81) in memory and externally sorted'''
+
+    handle, filename = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(handle, 'w') as f:
+        f.write(TINY_EWG)
+
+    try:
+        for chunk_edges in (1 << 20, 3):
+            edges = list()
+            result = minimum_spanning_forest(filename, chunk_edges=chunk_edges, output=edges.append)
+            assert abs(result['weight'] - 1.81) < 1e-9, 'MST weight {}, expected 1.81'.format(result['weight'])
+            assert result['edges'] == 7 and result['components'] == 1, 'MST should have 7 edges'
+            assert [edge[0] for edge in edges] == sorted(edge[0] for edge in edges), 'Edges out of order'
+
+            # Removing the 2 heaviest MST edges leaves {6}, {1, 3, 5, 7, 0, 2} and {4}
+            labels = single_linkage_clusters(filename, 3, chunk_edges)
+            clusters = dict()
+            for v, label in enumerate(labels):
+                clusters.setdefault(label, set()).add(v)
+            expected = [{0, 1, 2, 3, 5, 7}, {4}, {6}]
+            assert sorted(clusters.values(), key=min) == expected, 'Clusters {}'.format(clusters)
+    finally:
+        os.remove(filename)
+
+    print('All tests passed')
+
+def main(argv=None):
+    '''
+    Function called to run main script including unit tests
+    INPUT: List of arguments from the command line:
+        <edge-weighted graph file> [clusters] [edges per chunk]
+    RETURNS: Exit code to be passed to sys.exit():
+        -1: Invalid input
+         0: Script completed successfully
+    '''
+    if argv is None:
+        argv = sys.argv
+
+    options = argv[1:]
+    if not options:
+        test_kruskal()
+        return 0
+
+    clusters = int(options[1]) if len(options) > 1 else 1
+    chunk_edges = int(options[2]) if len(options) > 2 else 1 << 20
+    if clusters < 1:
+        print('Error - need at least 1 cluster, got {}'.format(clusters))
+        return -1
+
+    result = minimum_spanning_forest(options[0], clusters, chunk_edges)
+    print('{} vertices, {} edges'.format(result['V'], result['E']))
+    print('Forest weight {:.5f} with {} edges, {} components'.format(
+        result['weight'], result['edges'], result['components']))
+    print('Took {:.2f}s'.format(result['time']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
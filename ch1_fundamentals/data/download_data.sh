@@ -10,3 +10,8 @@ wget http://algs4.cs.princeton.edu/15uf/largeUF.txt
 # CH 1.4 3-sum data
 wget http://algs4.cs.princeton.edu/14analysis/1Mints.txt
 
+
+# CH 4.3 Edge-weighted graph data (Kruskal)
+wget http://algs4.cs.princeton.edu/43mst/tinyEWG.txt
+wget http://algs4.cs.princeton.edu/43mst/mediumEWG.txt
+wget http://algs4.cs.princeton.edu/43mst/largeEWG.txt
@@ -0,0 +1,252 @@
+# Doubly linked list shared by the linked-list stacks and queues
+import sys
+import tracemalloc
+
+from timeit import default_timer
+
+class LinkedListNode(object):
+    '''Node inside a linked list. __slots__ keeps each node to three
+    references, with no per-node __dict__'''
+    __slots__ = ('item', 'next_node', 'prev_node')
+
+    def __init__(self, item, next_node, prev_node=None):
+        self.item = item
+        self.next_node = next_node
+        self.prev_node = prev_node
+
+    def __repr__(self):
+        return 'Item: {}'.format(self.item)
+
+class LinkedList(object):
+    '''Doubly linked list with a maintained element count, so pushes, pops,
+    size() and is_empty() are all O(1) at both ends.
+    With recycle=True popped nodes are kept on a free-list (up to max_free)
+    and reused by later pushes, which cuts allocation churn for stacks and
+    queues that grow and shrink repeatedly'''
+
+    def __init__(self, verbose=False, recycle=False, max_free=1024):
+        '''Creates a new linked list with no entries initially'''
+        self.first = None
+        self.last = None
+        self.count = 0
+        self.modifications = 0 # Bumped on every push/pop so iterators can fail fast
+        self.verbose = verbose
+        self.recycle = recycle
+        self.max_free = max_free
+        self.free = None # Singly linked through next_node
+        self.free_count = 0
+
+    def __repr__(self):
+        '''Returns a list of all the items in the linked list'''
+        items = list()
+        node = self.first
+        while node is not None:
+            items.append(node.item)
+            node = node.next_node
+        return str(items)
+
+    def __iter__(self):
+        '''Iterates over the items from front to back without copying. Raises
+        RuntimeError if the list is pushed or popped during iteration'''
+        return self.iterate(self.modifications)
+
+    def iterate(self, modifications):
+        '''Generator for __iter__, given the modification count read by iter()'''
+        if self.modifications != modifications:
+            raise RuntimeError('linked list changed during iteration')
+        node = self.first
+        while node is not None:
+            yield node.item
+            if self.modifications != modifications:
+                raise RuntimeError('linked list changed during iteration')
+            node = node.next_node
+
+    def __len__(self):
+        return self.count
+
+    def new_node(self, item, next_node, prev_node):
+        '''Takes a node from the free-list, which must not be empty'''
+        node = self.free
+        self.free = node.next_node
+        self.free_count -= 1
+        node.item = item
+        node.next_node = next_node
+        node.prev_node = prev_node
+        return node
+
+    def release(self, node):
+        '''Returns the item of a removed node, keeping the node for reuse if
+        the free-list has room'''
+        item = node.item
+        if self.free_count < self.max_free:
+            node.item = None # Don't keep a reference to the item
+            node.prev_node = None
+            node.next_node = self.free
+            self.free = node
+            self.free_count += 1
+        return item
+
+    def push_front(self, item):
+        '''Adds an item to the front of the list'''
+        old_first = self.first
+        if self.free is None:
+            self.first = LinkedListNode(item, old_first, None)
+        else:
+            self.first = self.new_node(item, old_first, None)
+        if old_first is None:
+            self.last = self.first
+        else:
+            old_first.prev_node = self.first
+        self.count += 1
+        self.modifications += 1
+        if self.verbose: print('After push: {}'.format(self))
+
+    def pop_front(self):
+        '''Pops the item at the front of the list'''
+        old_first = self.first
+        if old_first is None:
+            raise IndexError('pop from empty list')
+        self.first = old_first.next_node
+        if self.first is None:
+            self.last = None
+        else:
+            self.first.prev_node = None
+        self.count -= 1
+        self.modifications += 1
+        if self.verbose: print('After pop : {}'.format(self))
+        if self.recycle:
+            return self.release(old_first)
+        return old_first.item
+
+    def push_back(self, item):
+        '''Adds an item to the back of the list'''
+        old_last = self.last
+        if self.free is None:
+            self.last = LinkedListNode(item, None, old_last)
+        else:
+            self.last = self.new_node(item, None, old_last)
+        if old_last is None:
+            self.first = self.last
+        else:
+            old_last.next_node = self.last
+        self.count += 1
+        self.modifications += 1
+        if self.verbose: print('After enqueue: {}'.format(self))
+
+    def pop_back(self):
+        '''Pops the item at the back of the list'''
+        old_last = self.last
+        if old_last is None:
+            raise IndexError('pop from empty list')
+        self.last = old_last.prev_node
+        if self.last is None:
+            self.first = None
+        else:
+            self.last.next_node = None
+        self.count -= 1
+        self.modifications += 1
+        if self.verbose: print('After pop_back: {}'.format(self))
+        if self.recycle:
+            return self.release(old_last)
+        return old_last.item
+
+    def is_empty(self):
+        '''Is the list empty?'''
+        return self.count == 0
+
+    def size(self):
+        ''' Check how many items are in the linked list'''
+        return self.count
+
+def benchmark(n=10**6):
+    '''
+    Measures memory per element and push/pop throughput, with and without
+    the free-list, against a plain Python list
+    INPUT: Number of elements
+    RETURNS: None
+    '''
+    def fill(push):
+        for item in range(n):
+            push(item)
+
+    def drain(pop):
+        for _ in range(n):
+            pop()
+
+    cases = (('LinkedList', lambda: LinkedList(), 'push_back', 'pop_front'),
+             ('LinkedList (recycle)', lambda: LinkedList(recycle=True), 'push_back', 'pop_front'),
+             ('list', list, 'append', 'pop'))
+    for name, create, push, pop in cases:
+        tracemalloc.start()
+        items = create()
+        fill(getattr(items, push))
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del items
+
+        # Fill and drain 4 times so the free-list gets reused
+        items = create()
+        start = default_timer()
+        for _ in range(4):
+            fill(getattr(items, push))
+            drain(getattr(items, pop))
+        time = default_timer() - start
+        print('{:22} - {:.1f} bytes/element (including the int), {:.0f} ops/s'.format(
+            name, used / n, 8 * n / time))
+
+# Unit tests for the linked list
+if __name__ == '__main__':
+
+    if sys.argv[1:] == ['bench']:
+        benchmark()
+        sys.exit(0)
+
+    for recycle in (False, True):
+        linked_list = LinkedList(recycle=recycle, max_free=2)
+        assert linked_list.size() == 0
+        assert linked_list.is_empty() == True
+
+        linked_list.push_back('b')
+        linked_list.push_front('a')
+        linked_list.push_back('c')
+        assert str(linked_list) == "['a', 'b', 'c']"
+        assert linked_list.size() == 3 and len(linked_list) == 3
+        assert linked_list.is_empty() == False
+        assert list(linked_list) == ['a', 'b', 'c']
+        try:
+            for item in linked_list:
+                linked_list.push_back('d')
+            assert False, 'Iterating while pushing did not fail'
+        except RuntimeError:
+            pass
+        assert linked_list.pop_back() == 'd'
+        items = iter(linked_list)
+        linked_list.push_back('d')
+        try:
+            list(items)
+            assert False, 'Pushing after iter() did not fail'
+        except RuntimeError:
+            pass
+        assert linked_list.pop_back() == 'd'
+
+        assert linked_list.pop_back() == 'c'
+        assert linked_list.pop_front() == 'a'
+        assert linked_list.pop_back() == 'b'
+        assert linked_list.size() == 0
+        assert linked_list.is_empty() == True
+        assert linked_list.first is None and linked_list.last is None
+
+        try:
+            linked_list.pop_front()
+            assert False, 'pop_front on an empty list should raise'
+        except IndexError:
+            pass
+
+        # Reuse (or not) the popped nodes, the free-list never grows past max_free
+        for item in range(5):
+            linked_list.push_front(item)
+        assert linked_list.free_count == 0
+        assert [linked_list.pop_back() for _ in range(5)] == [0, 1, 2, 3, 4]
+        assert linked_list.free_count == (2 if recycle else 0)
+
+    print('All tests passed')
@@ -0,0 +1,25 @@
+# Loader for ch1.5_union_find.py, shared by the scripts built on union-find
+import importlib.util
+import os
+import sys
+
+def load_union_find():
+    '''
+    Imports ch1.5_union_find.py, which can't be imported by name because of
+    the dots in its filename. The module is registered in sys.modules as
+    union_find, so it only runs once however many scripts load it
+    INPUT:
+    RETURNS: Module object
+    '''
+    if 'union_find' in sys.modules:
+        return sys.modules['union_find']
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ch1.5_union_find.py')
+    spec = importlib.util.spec_from_file_location('union_find', filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['union_find'] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules['union_find']
+        raise
+    return module